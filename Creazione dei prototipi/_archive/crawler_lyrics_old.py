@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
-import os, json, time, re, logging, tempfile, sys, argparse, random
+import os, json, time, re, logging, tempfile, sys, argparse, threading, sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from slugify import slugify            # pip install python-slugify
 from unidecode import unidecode        # pip install unidecode
 from lyricsgenius import Genius        # pip install lyricsgenius
+try:
+    import orjson                      # pip install orjson (opzionale, serializzazione più veloce)
+except ImportError:
+    orjson = None
 
 # ========== CONFIG ==========
 JSON_PATH = r"C:\Users\Utente\Desktop\DEGARI-Music\Creazione dei prototipi\descr_music.json"
@@ -14,8 +20,7 @@ if not TOKEN:
     sys.exit("ERRORE: GENIUS_TOKEN non impostato (cmd:  setx GENIUS_TOKEN <il_tuo_token>  e riapri il terminale)")
 
 BASE_DIR = Path(__file__).resolve().parent
-CACHE_DIR = BASE_DIR / "cache_lyrics"
-CACHE_DIR.mkdir(parents=True, exist_ok=True)
+CACHE_DIR = BASE_DIR / "cache_lyrics"  # creata da main() all'apertura di LyricsStore
 
 DEFAULT_SEED = [
     ("Eminem", "rap"),
@@ -38,6 +43,9 @@ DEFAULT_SEED = [
 
 EXCLUDED_TERMS = ["(Remix)", "(Live)", "(Demo)"]
 
+# numero massimo di richieste Genius in volo contemporaneamente (ricerche artista + lyrics)
+MAX_WORKERS = 8
+
 genius = Genius(
     TOKEN,
     skip_non_songs=True,
@@ -45,41 +53,176 @@ genius = Genius(
     remove_section_headers=True,
     timeout=15,
     retries=0,          # gestiamo noi i retry
-    sleep_time=0.0,     # gestiamo noi il backoff
+    sleep_time=0.0,     # il ritmo lo decide GeniusRateLimiter
     verbose=False,
 )
 
+def configure_http_pool(genius_client: Genius, pool_size: int) -> None:
+    """
+    lyricsgenius usa già una requests.Session interna (API e scraping lyrics):
+    le si monta un HTTPAdapter con pool grande quanto i worker, così le connessioni
+    keep-alive vengono riusate da tutti i thread invece di essere scartate a pool pieno.
+    """
+    session = getattr(genius_client, "_session", None)
+    if session is None:
+        return
+    from requests.adapters import HTTPAdapter  # dipendenza di lyricsgenius
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size), max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Connection"] = "keep-alive"
+
+# ========== RATE LIMIT ==========
+# Ritmo iniziale e limiti (richieste/secondo) del limiter condiviso
+RATE_INITIAL = 4.0
+RATE_MIN     = 0.5
+RATE_MAX     = 20.0
+
+class GeniusRateLimiter:
+    """
+    Token bucket unico condiviso da tutti i thread del crawler.
+    - acquire(): attende finché non c'è un token (ritmo = refill_rate req/s)
+    - record(ok): stima la congestione dal rapporto 429/successi su una finestra
+      e adatta refill_rate in modo AIMD (dimezza se troppi 429, +step se tutto ok)
+    """
+
+    def __init__(self, rate: float = RATE_INITIAL, burst: int = 4,
+                 min_rate: float = RATE_MIN, max_rate: float = RATE_MAX,
+                 window: int = 20, deny_thr: float = 0.1, step: float = 0.5):
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.refill_rate = rate
+        self.min_rate, self.max_rate = min_rate, max_rate
+        self.window, self.deny_thr, self.step = window, deny_thr, step
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+        self.succ = 0
+        self.denied = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.refill_rate
+            time.sleep(wait)
+
+    def record(self, ok: bool) -> None:
+        with self.lock:
+            if ok:
+                self.succ += 1
+            else:
+                self.denied += 1
+            total = self.succ + self.denied
+            if self.denied / total > self.deny_thr and (not ok or total >= self.window):
+                # congestione: decremento moltiplicativo, svuota il bucket per tutti
+                self._refill()
+                self.refill_rate = max(self.min_rate, self.refill_rate / 2)
+                self.tokens = 0.0
+                self.succ = self.denied = 0
+            elif total >= self.window:
+                # finestra pulita: incremento additivo
+                self.refill_rate = min(self.max_rate, self.refill_rate + self.step)
+                self.succ = self.denied = 0
+
+limiter = GeniusRateLimiter()
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
 # ========== UTILS ==========
-BRACKET_RE     = re.compile(r"\[.*?\]")
-JUNK_LINES_RE  = re.compile(r"(?im)^\s*(you might also like|embed|translation[s]?:?|more on genius).*$")
-MULTISPACE_RE  = re.compile(r"\s+")
+# righe spurie di Genius, tag [Chorus]/[Verse] e spazi multipli in un'unica alternanza:
+# un solo passaggio sul testo invece di tre. Le righe spurie vanno per prime, così
+# vengono riconosciute a inizio riga prima che \s consumi l'indentazione.
+CLEAN_RE = re.compile(
+    r"(?im)(?:^\s*(?:you might also like|embed|translation[s]?:?|more on genius).*$"
+    r"|\[.*?\]"
+    r"|\s)+"
+)
 
 def clean_lyrics(lyrics: str) -> str:
     if not lyrics:
         return ""
-    t = JUNK_LINES_RE.sub(" ", lyrics)
-    t = BRACKET_RE.sub(" ", t)
-    t = unidecode(t)
-    t = MULTISPACE_RE.sub(" ", t).strip()
-    return t
+    return CLEAN_RE.sub(" ", unidecode(lyrics)).strip()
+
+def is_rate_limited(e: Exception) -> bool:
+    msg = str(e).lower()
+    return "429" in msg or "rate limit" in msg or "timed out" in msg or "timeout" in msg
+
+# memo dei JSON già parsati: path -> (mtime, dati). Se il file non è cambiato non si
+# ri-parsa; se è cambiato la voce viene sostituita (una sola copia per file)
+_json_cache: Dict[str, Tuple[float, Any]] = {}
 
 def load_json(path: str) -> List[Dict[str, Any]]:
     if not os.path.exists(path):
         return []
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    key = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    cached = _json_cache.get(key)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = _json_cache[key] = (mtime, json.load(f))
+    return cached[1]
 
 def atomic_save_json(path: str, data: Any) -> None:
     # scrittura atomica per evitare file corrotti
     d = Path(path).parent
     d.mkdir(parents=True, exist_ok=True)
-    with tempfile.NamedTemporaryFile("w", delete=False, dir=d, encoding="utf-8") as tmp:
-        json.dump(data, tmp, ensure_ascii=False, indent=2)
-        tmp_path = tmp.name
+    if orjson is not None:
+        with tempfile.NamedTemporaryFile("wb", delete=False, dir=d) as tmp:
+            tmp.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+            tmp_path = tmp.name
+    else:
+        with tempfile.NamedTemporaryFile("w", delete=False, dir=d, encoding="utf-8") as tmp:
+            json.dump(data, tmp, ensure_ascii=False, indent=2)
+            tmp_path = tmp.name
     os.replace(tmp_path, path)
 
+def pending_path_for(json_path: str) -> str:
+    # file JSONL a fianco del JSON finale: un brano per riga, scritto man mano
+    return json_path + ".pending.jsonl"
+
+def append_jsonl(f, item: Dict[str, Any]) -> None:
+    f.write(json.dumps(item, ensure_ascii=False) + "\n")
+    f.flush()
+
+def iter_jsonl(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # ultima riga troncata da un'interruzione: si scarta
+                continue
+
+def merge_pending(json_path: str) -> int:
+    """
+    Unisce i brani del file .pending.jsonl (run corrente o run interrotta) nel JSON
+    finale indentato, con dedup per ID, e rimuove il file pending.
+    Ritorna il totale dei brani nel JSON.
+    """
+    data = list(load_json(json_path))
+    pending = pending_path_for(json_path)
+    if not os.path.exists(pending):
+        return len(data)
+    ids = {d.get("ID") for d in data if isinstance(d, dict)}
+    for item in iter_jsonl(pending):
+        if item.get("ID") not in ids:
+            data.append(item)
+            ids.add(item.get("ID"))
+    atomic_save_json(json_path, data)
+    os.remove(pending)
+    return len(data)
+
 def coerce_str(x) -> str:
     # evita Ellipsis e None
     if x is Ellipsis or x is None:
@@ -87,13 +230,23 @@ def coerce_str(x) -> str:
     return str(x)
 
 def strip_ellipsis(obj):
-    # rimuove ricorsivamente Ellipsis da dizionari/liste
+    # sostituisce ricorsivamente Ellipsis con "" in dizionari/liste, modificandoli sul posto
+    # (niente ricostruzione dei contenitori). Serve solo sui dict di lyricsgenius:
+    # un file JSON non può contenere Ellipsis.
     if obj is Ellipsis:
         return ""
     if isinstance(obj, dict):
-        return {k: strip_ellipsis(v) for k, v in obj.items()}
-    if isinstance(obj, list):
-        return [strip_ellipsis(v) for v in obj]
+        for k, v in obj.items():
+            if v is Ellipsis:
+                obj[k] = ""
+            elif isinstance(v, (dict, list)):
+                strip_ellipsis(v)
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            if v is Ellipsis:
+                obj[i] = ""
+            elif isinstance(v, (dict, list)):
+                strip_ellipsis(v)
     return obj
 
 def safe_year_from_fields(song_dict: Dict[str, Any]) -> str:
@@ -103,8 +256,13 @@ def safe_year_from_fields(song_dict: Dict[str, Any]) -> str:
         return date[:4]
     return ""
 
+@lru_cache(maxsize=4096)
+def _slug(s: str) -> str:
+    # gli artisti si ripetono per molti brani: lo slug si calcola una volta sola
+    return slugify(s)
+
 def make_id(artist: str, title: str, genre: str, year: str = "", genius_id: Optional[int] = None) -> str:
-    base = f"{genre}_{slugify(artist)[:10]}_{slugify(title)[:16]}"
+    base = f"{genre}_{_slug(artist)[:10]}_{_slug(title)[:16]}"
     year = coerce_str(year)
     if year:
         base += f"_{year}"
@@ -112,39 +270,86 @@ def make_id(artist: str, title: str, genre: str, year: str = "", genius_id: Opti
         base += f"_{genius_id}"
     return base
 
-def cache_path_for(song_id: int) -> Path:
+# ========== CACHE LYRICS ==========
+class LyricsStore:
+    """
+    Cache lyrics in un unico file SQLite (tabella lyrics(song_id, text)) invece di
+    un JSON per brano. Connessione unica condivisa fra i thread (serializzata da lock);
+    put() non fa commit: le scritture vengono confermate in blocco da commit().
+    Aperta da main() (non all'import); close() conferma le scritture rimaste.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS lyrics (song_id INTEGER PRIMARY KEY, text TEXT NOT NULL)")
+            self.conn.commit()
+
+    def get(self, song_id: int) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute("SELECT text FROM lyrics WHERE song_id = ?", (song_id,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, song_id: int, text: str) -> None:
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO lyrics (song_id, text) VALUES (?, ?)", (song_id, text))
+
+    def commit(self) -> None:
+        with self.lock:
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+lyrics_store: Optional[LyricsStore] = None  # aperta da main()
+
+def legacy_cache_path_for(song_id: int) -> Path:
+    # vecchia cache (un JSON per brano): letta solo per migrare i testi già scaricati
     return CACHE_DIR / f"{song_id}.json"
 
 def get_lyrics_with_cache(song_id: Optional[int], url: Optional[str] = None) -> Optional[str]:
-    cp = cache_path_for(song_id) if song_id else None
-    if cp and cp.exists():
-        try:
-            return json.loads(cp.read_text("utf-8")).get("lyrics")
-        except Exception:
-            pass
+    if song_id:
+        cached = lyrics_store.get(song_id)
+        if cached is not None:
+            return cached
+        cp = legacy_cache_path_for(song_id)
+        if cp.exists():
+            try:
+                cached = json.loads(cp.read_text("utf-8")).get("lyrics")
+            except Exception:
+                cached = None
+            if cached:
+                lyrics_store.put(song_id, cached)
+                return cached
 
-    delay = 0.6
     for attempt in range(5):
+        limiter.acquire()
         try:
             text = None
             if song_id:
                 text = genius.lyrics(song_id=song_id)
             elif url:
                 text = genius.lyrics(url=url)
+            limiter.record(True)
             text = clean_lyrics(text)
             if text:
-                if cp:
-                    cp.write_text(json.dumps({"lyrics": text}, ensure_ascii=False), encoding="utf-8")
+                if song_id:
+                    lyrics_store.put(song_id, text)
                 return text
             return None
         except Exception as e:
-            msg = str(e).lower()
-            if "429" in msg or "rate limit" in msg or "timed out" in msg or "timeout" in msg:
-                sleep_for = delay * (2 ** attempt) + random.uniform(0, 0.6)
-                logging.warning("Rate limit (tentativo %s), sleep %.1fs", attempt + 1, sleep_for)
-                time.sleep(sleep_for)
+            if is_rate_limited(e):
+                limiter.record(False)
+                logging.warning("Rate limit (tentativo %s), ritmo ridotto a %.2f req/s", attempt + 1, limiter.refill_rate)
                 continue
             logging.warning("Errore lyrics song_id=%s: %s", song_id, e)
+            # errore non di rate limit (es. rete): breve pausa prima di riprovare
             time.sleep(0.5 + 0.2 * attempt)
     return None
 
@@ -180,21 +385,23 @@ def mk_item_from(song_dict: Dict[str, Any], genre: str) -> Dict[str, Any]:
         "contexts": []
     }
 
-def search_artist_with_backoff(genius_client: Genius, artist: str, max_songs: int, sort: str = "popularity", attempts: int = 5):
-    delay = 0.6
+def search_artist_with_retry(genius_client: Genius, artist: str, max_songs: int, sort: str = "popularity", attempts: int = 5):
+    # i tentativi sono cadenzati dal limiter condiviso; dopo un errore che non è
+    # di rate limit (es. rete) c'è anche una breve pausa, come prima del limiter
     last_exc = None
     for i in range(attempts):
+        limiter.acquire()
         try:
-            return genius_client.search_artist(artist, max_songs=max_songs, sort=sort)
+            a = genius_client.search_artist(artist, max_songs=max_songs, sort=sort)
+            limiter.record(True)
+            return a
         except Exception as e:
             last_exc = e
-            msg = str(e).lower()
-            if "429" in msg or "rate limit" in msg or "timed out" in msg or "timeout" in msg:
-                sleep_for = delay * (2 ** i) + random.uniform(0, 0.5)
-                logging.warning("search_artist('%s') tentativo %d fallito, attendo %.1fs", artist, i+1, sleep_for)
-                time.sleep(sleep_for)
-                continue
-            time.sleep(0.5 + 0.2 * i)
+            if is_rate_limited(e):
+                limiter.record(False)
+                logging.warning("search_artist('%s') tentativo %d fallito, ritmo ridotto a %.2f req/s", artist, i+1, limiter.refill_rate)
+            else:
+                time.sleep(0.5 + 0.2 * i)
     raise last_exc
 
 # ========== MAIN ==========
@@ -203,7 +410,9 @@ def main():
     ap.add_argument("--max-per-artist", type=int, default=3, help="max brani per artista")
     ap.add_argument("--seed", type=str, nargs="*", help='coppie "Artista:genere" (override seed)')
     ap.add_argument("--json-path", type=str, default=JSON_PATH, help="path al descr_music.json")
+    ap.add_argument("--workers", type=int, default=MAX_WORKERS, help="richieste Genius concorrenti")
     args = ap.parse_args()
+    configure_http_pool(genius, args.workers)
 
     # SEED: CLI o default
     if args.seed:
@@ -216,52 +425,92 @@ def main():
     else:
         seed = DEFAULT_SEED
 
+    merge_pending(args.json_path)  # recupera eventuali brani di una run interrotta
     data = load_json(args.json_path)
-    data = strip_ellipsis(data)  # sanifica eventuali vecchi Ellipsis nel file già esistente
-    seen_ids   = {d.get("ID") for d in data if isinstance(d, dict)}
-    seen_gids  = {d.get("genius_id") for d in data if isinstance(d, dict) and d.get("genius_id")}
-
-    added = 0
-    for artist, genre in seed:
-        print(f"\n== {artist} ({genre}) ==")
-        try:
-            a = search_artist_with_backoff(genius, artist, max_songs=args.max_per_artist, sort="popularity")
-        except Exception as e:
-            print("  ! errore artista:", artist, e)
-            continue
-
-        songs = (a.songs or [])[: args.max_per_artist]
-        for s in songs:
-            try:
-                s_dict = s.to_dict() if hasattr(s, "to_dict") else getattr(s, "__dict__", {})
-                s_dict = strip_ellipsis(s_dict)  # <-- sanifica subito
-                gid = s_dict.get("id")
-
-                if gid and gid in seen_gids:
-                    print("  - dup(gid):", gid)
+    seen_ids, seen_gids = set(), set()
+    for d in data:
+        if isinstance(d, dict):
+            seen_ids.add(d.get("ID"))
+            gid = d.get("genius_id")
+            if gid:
+                seen_gids.add(gid)
+
+    global lyrics_store
+    lyrics_store = LyricsStore(CACHE_DIR / "lyrics.db")
+    try:
+        added = 0
+        pending_path = pending_path_for(args.json_path)
+        Path(pending_path).parent.mkdir(parents=True, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool, \
+                open(pending_path, "a", encoding="utf-8") as pending_f:
+            # 1) ricerche artista tutte in parallelo
+            searches = [
+                (artist, genre, pool.submit(search_artist_with_retry, genius, artist,
+                                        max_songs=args.max_per_artist, sort="popularity"))
+                for artist, genre in seed
+            ]
+
+            # 2) appena un artista è pronto, accoda subito il download delle sue lyrics;
+            #    il dedup per genius_id avviene qui (thread principale) per non scaricare doppioni
+            jobs = []
+            pending_gids = set(seen_gids)
+            for artist, genre, fut in searches:
+                try:
+                    a = fut.result()
+                except Exception as e:
+                    jobs.append((artist, genre, e, []))
                     continue
-
-                item = mk_item_from(s_dict, genre)
-                item = strip_ellipsis(item)  # ulteriore safety
-
-                if item["ID"] in seen_ids:
-                    print("  - dup(ID):", item["ID"])
+                tasks = []
+                for s in (a.songs or [])[: args.max_per_artist]:
+                    try:
+                        s_dict = s.to_dict() if hasattr(s, "to_dict") else getattr(s, "__dict__", {})
+                        s_dict = strip_ellipsis(s_dict)  # <-- sanifica subito
+                        gid = s_dict.get("id")
+                        if gid and gid in pending_gids:
+                            tasks.append((s, gid, None))
+                            continue
+                        if gid:
+                            pending_gids.add(gid)
+                        tasks.append((s, gid, pool.submit(mk_item_from, s_dict, genre)))
+                    except Exception as e:
+                        tasks.append((s, None, e))
+                jobs.append((artist, genre, None, tasks))
+
+            # 3) raccolta risultati nell'ordine del seed (output e dedup per ID deterministici)
+            for artist, genre, err, tasks in jobs:
+                print(f"\n== {artist} ({genre}) ==")
+                if err is not None:
+                    print("  ! errore artista:", artist, err)
                     continue
-
-                data.append(item)
-                seen_ids.add(item["ID"])
-                if gid:
-                    seen_gids.add(gid)
-                print("  + add:", item["ID"])
-                added += 1
-            except Exception as e:
-                print("  ! errore song:", getattr(s, "title", "?"), e)
-
-            time.sleep(0.1)  # minima gentilezza
-
-    data = strip_ellipsis(data)  # safety finale
-    atomic_save_json(args.json_path, data)
-    print(f"\nAggiornato: {args.json_path} -> Totale brani: {len(data)} (aggiunti {added})")
+                for s, gid, job in tasks:
+                    if job is None:
+                        print("  - dup(gid):", gid)
+                        continue
+                    try:
+                        if isinstance(job, Exception):
+                            raise job
+                        item = job.result()
+
+                        if item["ID"] in seen_ids:
+                            print("  - dup(ID):", item["ID"])
+                            continue
+
+                        append_jsonl(pending_f, item)
+                        seen_ids.add(item["ID"])
+                        if gid:
+                            seen_gids.add(gid)
+                        print("  + add:", item["ID"])
+                        added += 1
+                    except Exception as e:
+                        print("  ! errore song:", getattr(s, "title", "?"), e)
+                lyrics_store.commit()  # una transazione per artista
+    finally:
+        # conferma anche l'ultimo blocco di scritture se la run si interrompe
+        lyrics_store.close()
+        lyrics_store = None
+
+    total = merge_pending(args.json_path)
+    print(f"\nAggiornato: {args.json_path} -> Totale brani: {total} (aggiunti {added})")
 
 if __name__ == "__main__":
     main()
@@ -3,12 +3,39 @@ import os
 import json
 import string
 import re
+import heapq
+import hashlib
+import sqlite3
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import lru_cache
+from operator import attrgetter, itemgetter
 from typing import Dict, Iterable, List, Tuple, Any, Optional
 
-# Componenti NLP
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
+# Componenti NLP: TreeTagger (o spaCy, opzionale) fa tokenizzazione, POS e lemmi; da NLTK servono
+# solo le stopword inglesi, quindi è opzionale (senza, si filtrano le sole FUNCTION_WORDS)
 import treetaggerwrapper
+try:
+    from nltk.corpus import stopwords
+except ImportError:
+    stopwords = None
+
+try:
+    import spacy  # opzionale: backend alternativo a TreeTagger (cfg.nlpBackend = "spacy")
+except ImportError:
+    spacy = None
+
+try:
+    import orjson  # opzionale: parsing JSON più veloce
+except ImportError:
+    orjson = None
+
+try:
+    import ijson  # opzionale: lettura in streaming dei file JSON molto grandi
+except ImportError:
+    ijson = None
 
 # Config del progetto (file locale con path e campi da usare)
 import prototyper_config as cfg
@@ -20,24 +47,50 @@ import prototyper_config as cfg
 PROJECT_ROOT = Path(__file__).resolve().parent.parent  # Root progetto: .../DEGARI-Music
 
 # Liste funzionali per filtrare token poco informativi (inglese)
-PREPOSITIONS = ["of","to","from","in","on","at","by","for",
+PREPOSITIONS = frozenset(("of","to","from","in","on","at","by","for",
                 "with","about","against","between","into",
                 "through","during","before","after","above",
-                "below","up","down","out","off","over","under"]
-ARTICLES = ["the","a","an"]
-CONJUNCTIONS = ["and","or","but","so","yet","for","nor","because",
+                "below","up","down","out","off","over","under"))
+ARTICLES = frozenset(("the","a","an"))
+CONJUNCTIONS = frozenset(("and","or","but","so","yet","for","nor","because",
                 "although","though","while","if","when","where","that",
                 "which","who","whom","whose","until","unless","since","as",
-                "than","whether","either","neither","both","also","only"]
-PUNCTUATION = list(string.punctuation) + ["...", "``"]  # Punteggiatura da scartare
+                "than","whether","either","neither","both","also","only"))
+PUNCTUATION = frozenset(string.punctuation) | {"...", "``"}  # Punteggiatura da scartare
+FUNCTION_WORDS = PREPOSITIONS | ARTICLES | CONJUNCTIONS | PUNCTUATION  # unico set per il filtro token
 CHARS_NOT_ALLOWED = ['\\', '/', ':', '*', '?', '"', '<', '>', '|']  # Caratteri illegali per filename (Win)
+# tabella per str.translate: cancella i caratteri illegali e sostituisce gli apostrofi con "_"
+_FILENAME_DEL_TBL = str.maketrans("'", "_", "".join(CHARS_NOT_ALLOWED))
 
 # Range per lo score normalizzato dei prototipi
 MIN_SCORE = 0.6
 MAX_SCORE = 0.9
 ENCODING = "utf-8"
+STREAM_JSON_MIN_BYTES = 256 << 20  # lista JSON più grande di così: letta in streaming con ijson
+READ_WORKERS = 16  # thread per la lettura in parallelo dei file JSON di una directory
+WRITE_WORKERS = min(32, (os.cpu_count() or 4) * 4)  # thread per la scrittura dei file .txt (I/O-bound)
+TAG_BATCH = 256    # istanze taggate insieme in un'unica chiamata TreeTagger
+# Campi letti dal config una volta sola (fallback di default se assenti)
+_ID_KEY = getattr(cfg, "instanceID", "ID")
+_DESCR_FIELDS = tuple(getattr(cfg, "instanceDescr", ("title", "artist", "lyrics", "tags")))
+TOP_K = getattr(cfg, "topK", None)  # se impostato, parole scritte per prototipo (le più frequenti)
+OUT_FORMAT = getattr(cfg, "outFormat", "txt")  # "txt" (un file per artwork, letto da cocos) | "jsonl"
+JSONL_NAME = "prototypes.jsonl"
+STREAM_WRITE = getattr(cfg, "streamWrite", False)  # scrive e libera ogni blocco appena elaborato
+WORKERS = os.cpu_count() or 1  # processi TreeTagger del pool (TaggerPoll) e blocchi taggati in parallelo
+
+NLP_BACKEND = getattr(cfg, "nlpBackend", "treetagger")  # "treetagger" | "spacy"
+SPACY_MODEL = "en_core_web_sm"
 
 TAGGER = None  # Inizializzato in main() se TreeTagger è disponibile
+NLP = None     # Pipeline spaCy, inizializzata in main() solo con NLP_BACKEND = "spacy"
+STOPWORDS_EN: frozenset = frozenset()  # Inizializzato in main() dopo ensure_nltk()
+REMOVE_WORDS: frozenset = FUNCTION_WORDS  # + STOPWORDS_EN, completato in main()
+
+_JUNK_TOKEN_RE   = re.compile(r"^[\W\d_]+$")  # token di sola punteggiatura/cifre
+_TOKEN_RE        = re.compile(r"[^\W\d_](?:[^\W\d_]|')+")  # parole (lettere + apostrofi), almeno 2 caratteri
+_SLUG_INVALID_RE = re.compile(r"[^\w\s-]+")
+_SLUG_SEP_RE     = re.compile(r"[\s_-]+")
 
 # =============================================================================
 # Utility per path e I/O
@@ -51,6 +104,15 @@ def resolve_input_path() -> Path:
     raw = Path(cfg.jsonDescrFile)
     return raw if raw.is_absolute() else (PROJECT_ROOT / raw)
 
+def resolve_tag_cache_path() -> Optional[Path]:
+    # Path della cache persistente dei tag (cfg.tagCachePath); None se disattivata.
+    # Se relativo viene risolto sotto la root del progetto, come outPath.
+    raw = getattr(cfg, "tagCachePath", None)
+    if not raw:
+        return None
+    p = Path(raw)
+    return p if p.is_absolute() else (PROJECT_ROOT / p)
+
 def resolve_output_dir() -> Path:
     # Risolve/crea la cartella di output indicata in cfg.outPath
     # - se assoluta la usa così com'è
@@ -61,41 +123,38 @@ def resolve_output_dir() -> Path:
     p.mkdir(parents=True, exist_ok=True)
     return p
 
+@lru_cache(maxsize=100_000)
 def safe_slug(s: str) -> str:
     # Crea uno slug semplice: lowercase, alfanumerico con trattini singoli
     # Evita dipendenze esterne (es. slugify)
     s = (s or "").lower()
-    s = re.sub(r"[^\w\s-]+", " ", s)
-    s = re.sub(r"[\s_-]+", "-", s).strip("-")
+    s = _SLUG_INVALID_RE.sub(" ", s)
+    s = _SLUG_SEP_RE.sub("-", s).strip("-")
     return s
 
+@lru_cache(maxsize=100_000)
 def safe_filename(s: str) -> str:
-    # Rimuove caratteri non consentiti nei filename su Windows
+    # Rimuove caratteri non consentiti nei filename su Windows e sostituisce gli apostrofi
+    # (memoizzata: gli stessi ID/slug ricorrono fra istanze e run sul dataset esteso)
     if s is None:
         return ""
-    for ch in CHARS_NOT_ALLOWED:
-        s = s.replace(ch, "")
-    return s
+    return s.translate(_FILENAME_DEL_TBL)
 
 # =============================================================================
 # Gestione TreeTagger / NLTK
 # =============================================================================
 
 def ensure_nltk():
-    # Garantisce la disponibilità minima delle risorse NLTK:
-    # - stopwords inglesi
-    # - tokenizer 'punkt'
+    # Garantisce la disponibilità minima delle risorse NLTK: stopwords inglesi
+    # (la tokenizzazione usa TreeTagger o _TOKEN_RE, 'punkt' non serve più)
+    if stopwords is None:
+        print("[WARN] NLTK non installato: stopword inglesi non disponibili.")
+        return
     try:
         _ = stopwords.words('english')
     except (LookupError, OSError):
         import nltk
         nltk.download('stopwords', quiet=True)
-    try:
-        import nltk
-        nltk.data.find('tokenizers/punkt')
-    except (LookupError, OSError):
-        import nltk
-        nltk.download('punkt', quiet=True)
 
 def find_treetagger() -> Optional[str]:
     # Cerca automaticamente l'installazione di TreeTagger in questo ordine:
@@ -118,8 +177,38 @@ def find_treetagger() -> Optional[str]:
             return str(p)
     return None
 
-def make_tagger():
-    # Istanzia un TreeTagger inglese.
+def tagger_kwargs(tagdir: str) -> Dict[str, Optional[str]]:
+    # Parametri del TreeTagger inglese; se i file specifici non esistono, lascia None:
+    # il wrapper userà i default.
+    parfile = os.path.join(tagdir, "lib", "english-bnc.par")
+    abbrev  = os.path.join(tagdir, "lib", "english-abbreviations")
+    return dict(
+        TAGLANG="en",
+        TAGDIR=tagdir,
+        TAGPARFILE=parfile if os.path.exists(parfile) else None,
+        TAGABBREV=abbrev if os.path.exists(abbrev) else None,
+    )
+
+class PollTagger:
+    # Adattatore sincrono di treetaggerwrapper.TaggerPoll (pool di processi TreeTagger a
+    # lunga vita, thread-safe): il pool espone solo tag_text_async, che restituisce un Job;
+    # tag_text lo attende e ne restituisce il risultato, come TreeTagger.tag_text.
+    def __init__(self, workers: int, **kwargs):
+        self.poll = treetaggerwrapper.TaggerPoll(workerscount=workers, taggerscount=workers, **kwargs)
+
+    def tag_text(self, text, **kwargs):
+        job = self.poll.tag_text_async(text, **kwargs)
+        job.wait_finished()
+        if isinstance(job.result, BaseException):  # errore del processo di tagging
+            raise job.result
+        return job.result
+
+    def stop_poll(self):
+        self.poll.stop_poll()
+
+def make_tagger(workers: int = 1):
+    # Istanzia un TreeTagger inglese; con workers > 1 un pool TaggerPoll (via PollTagger),
+    # a cui le richieste dei thread vengono smistate.
     # Se non trova un'installazione valida, solleva RuntimeError con istruzioni.
     tagdir = find_treetagger()
     if not tagdir:
@@ -128,15 +217,22 @@ def make_tagger():
             r"- C:\Users\<utente>\Desktop\TreeTagger\n"
             f"- {PROJECT_ROOT / 'TreeTagger'}"
         )
-    parfile = os.path.join(tagdir, "lib", "english-bnc.par")
-    abbrev  = os.path.join(tagdir, "lib", "english-abbreviations")
-    # Se i file specifici non esistono, lascia None: il wrapper userà i default.
-    return treetaggerwrapper.TreeTagger(
-        TAGLANG="en",
-        TAGDIR=tagdir,
-        TAGPARFILE=parfile if os.path.exists(parfile) else None,
-        TAGABBREV=abbrev if os.path.exists(abbrev) else None,
-    )
+    kwargs = tagger_kwargs(tagdir)
+    if workers > 1:
+        return PollTagger(workers, **kwargs)
+    return treetaggerwrapper.TreeTagger(**kwargs)
+
+def make_spacy_nlp():
+    # Pipeline spaCy ridotta a tokenizer + tagger + attribute_ruler + lemmatizer:
+    # POS (tagset Penn, come TreeTagger inglese) e lemmi in un solo passaggio per testo.
+    if spacy is None:
+        raise RuntimeError("spaCy non installato (pip install spacy)")
+    return spacy.load(SPACY_MODEL, disable=["parser", "ner", "textcat"])
+
+def _spacy_doc_tags(doc) -> List[Tuple[str, str, str]]:
+    # Converte un Doc spaCy nello stesso formato di TreeTagger: [(token, pos, lemma), ...]
+    return [(tok.text, tok.tag_, tok.lemma_.lower() or tok.text)
+            for tok in doc if not tok.is_space]
 
 def get_tags(text: str):
     # Ritorna i tag TreeTagger per il testo, oppure lista vuota se il tagger non è pronto o fallisce.
@@ -148,39 +244,229 @@ def get_tags(text: str):
     except Exception:
         return []
 
+@lru_cache(maxsize=200_000)
+def _analyze(word: str) -> Tuple[str, str]:
+    # Unico round-trip TreeTagger per parola, memoizzato: ritorna (lemma, pos).
+    # Le parole si ripetono moltissimo fra brani (ritornelli, stopword, tag),
+    # quindi dopo il primo passaggio lemma e POS costano una lookup in cache.
+    # In fallback (assenza/errore del tagger) -> (parola lowercased, "").
+    tags = get_tags(word)
+    if not tags:
+        return word.lower(), ""
+    return _lemma_pos(tags[0], word)
+
+def _lemma_pos(tag, word: str) -> Tuple[str, str]:
+    # Estrae (lemma, pos) da un Tag di treetaggerwrapper; fallback (parola lowercased, "").
+    try:
+        return _clean_lemma_pos(word, str(tag.lemma or ""), str(tag.pos or ""))
+    except Exception:
+        return word.lower(), ""
+
+@lru_cache(maxsize=200_000)
+def _clean_lemma_pos(word: str, lemma: str, pos: str) -> Tuple[str, str]:
+    # Normalizzazione memoizzata per forma (parola, lemma, pos): nel testo taggato
+    # le stesse forme si ripetono moltissimo (ritornelli, stopword, tag di genere).
+    # TreeTagger talvolta usa "lemma:qualcosa": teniamo la parte prima di ':'
+    return lemma.split(":")[0] or word.lower(), pos.split(":")[0]
+
+def is_junk_token(word: str, remove_words: Optional[frozenset] = None) -> bool:
+    # Filtro economico, senza tagger: token troppo corti, stopword/funcword,
+    # numeri e token fatti solo di punteggiatura/cifre
+    if remove_words is None:
+        remove_words = REMOVE_WORDS
+    return (len(word) < 2 or word in remove_words or word.isdigit()
+            or _JUNK_TOKEN_RE.match(word) is not None)
+
+def tag_lyrics(text: str) -> List[Tuple[str, str, str]]:
+    # Tagga l'intero testo con una sola chiamata TreeTagger, lasciando a TreeTagger
+    # anche la tokenizzazione: ritorna [(token, pos, lemma), ...] con token lowercased.
+    # Il testo è passato in minuscolo, come quando si taggava parola per parola.
+    # Se il tagger manca o fallisce: tokenizzazione con regex + _analyze per parola.
+    text = text.lower()
+    if NLP is not None:
+        try:
+            return _spacy_doc_tags(NLP(text))
+        except Exception:
+            pass
+    if TAGGER is not None:
+        try:
+            out = []
+            for tag in treetaggerwrapper.make_tags(TAGGER.tag_text(text)):
+                if not isinstance(tag, treetaggerwrapper.Tag):
+                    continue  # NotTag (url, email, ... sostituiti dal tokenizer)
+                tok = str(tag.word or "").strip()
+                if tok:
+                    lemma, pos = _lemma_pos(tag, tok)
+                    out.append((tok, pos, lemma))
+            return out
+        except Exception:
+            pass
+
+    # i token scartati comunque dal filtro non arrivano al tagger; ogni parola distinta
+    # del testo (ritornelli, tag ripetuti) viene analizzata una sola volta
+    tokens = [tok for tok in _TOKEN_RE.findall(text) if not is_junk_token(tok)]
+    analysis = {tok: _analyze(tok) for tok in dict.fromkeys(tokens)}
+    return [(tok, analysis[tok][1], analysis[tok][0]) for tok in tokens]
+
+# Separatore fra descrizioni nel testo inviato a TreeTagger: è un tag SGML, che
+# TreeTagger restituisce invariato su una riga propria (NotTag per make_tags).
+ARTWORK_SEP = "<degarisep/>"
+
+# Cache persistente fra esecuzioni (opzionale, cfg.tagCachePath): file SQLite con
+# sha1(configurazione del tagger + descrizione lowercased) -> [(token, pos, lemma), ...] in JSON.
+# La configurazione (backend, lingua, file di parametri) fa parte della chiave: cambiandola
+# le voci precedenti non vengono riusate. Nessuna voce è tenuta in memoria: ogni blocco
+# legge dal file solo le proprie. Il file contiene solo dati (niente pickle), ma va comunque
+# considerato un file di lavoro locale: i tag letti sono usati così come sono.
+TAG_CACHE_VERSION = 1
+TAG_CACHE: Optional["TagCache"] = None
+TAG_SIGNATURE = ""  # configurazione del tagger in uso, impostata da main()
+
+class TagCache:
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # usata dai thread di iter_block_results: accessi serializzati dal lock
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != str(TAG_CACHE_VERSION):
+            # formato diverso (o file nuovo): si riparte da una cache vuota
+            self.conn.execute("DROP TABLE IF EXISTS tags")
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                              (str(TAG_CACHE_VERSION),))
+        self.conn.execute("CREATE TABLE IF NOT EXISTS tags (key TEXT PRIMARY KEY, tags TEXT NOT NULL)")
+        self.conn.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[Tuple[str, str, str]]]:
+        keys = list(keys)
+        out: Dict[str, List[Tuple[str, str, str]]] = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):  # limite dei parametri SQLite
+                chunk = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, tags FROM tags WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                for key, tags in rows:
+                    out[key] = [tuple(t) for t in json.loads(tags)]
+        return out
+
+    def put_many(self, items: Dict[str, List[Tuple[str, str, str]]]):
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO tags (key, tags) VALUES (?, ?)",
+                                  ((k, json.dumps(v, ensure_ascii=False)) for k, v in items.items()))
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
+
+def tagger_signature() -> str:
+    # Descrive la pipeline che produce i tag: con spaCy modello e versione, con TreeTagger
+    # lingua e file di parametri/abbreviazioni (con data di modifica)
+    if NLP is not None:
+        return f"spacy|{SPACY_MODEL}|{getattr(spacy, '__version__', '')}"
+    tagdir = find_treetagger()
+    if not tagdir:
+        return "treetagger"
+    parts = ["treetagger"]
+    for name, value in sorted(tagger_kwargs(tagdir).items()):
+        if name != "TAGDIR" and value and os.path.exists(value):
+            value = f"{value}@{os.path.getmtime(value):.0f}"
+        parts.append(f"{name}={value}")
+    return "|".join(parts)
+
+def _tag_key(text: str) -> str:
+    return hashlib.sha1((TAG_SIGNATURE + "\0" + text.lower()).encode(ENCODING)).hexdigest()
+
+def load_tag_cache(path: Optional[Path]):
+    # Apre la cache dei tag se configurata; un file illeggibile viene ignorato
+    global TAG_CACHE
+    TAG_CACHE = None
+    if path is None:
+        return
+    try:
+        TAG_CACHE = TagCache(path)
+    except Exception as e:
+        print(f"[WARN] cache dei tag ignorata ({path}): {e}")
+
+def save_tag_cache(path: Optional[Path]):
+    # Rende persistenti le nuove voci e chiude la cache
+    global TAG_CACHE
+    if TAG_CACHE is None:
+        return
+    TAG_CACHE.close()
+    TAG_CACHE = None
+
+def _tag_many_uncached(texts: List[str]) -> Tuple[List[List[Tuple[str, str, str]]], bool]:
+    # Tagga più descrizioni in un'unica chiamata TreeTagger: le concatena separate da
+    # ARTWORK_SEP e ridivide il flusso di tag sul separatore. Ritorna (segmenti, True)
+    # se il tagging in blocco è riuscito; altrimenti (tag_lyrics per ogni testo, False).
+    # Con il backend spaCy il blocco passa invece da NLP.pipe (nessun separatore).
+    if NLP is not None and texts:
+        try:
+            docs = NLP.pipe((t.lower() for t in texts), batch_size=TAG_BATCH)
+            return [_spacy_doc_tags(doc) for doc in docs], True
+        except Exception:
+            pass
+    if TAGGER is not None and texts:
+        try:
+            blob = f"\n{ARTWORK_SEP}\n".join(t.lower() for t in texts)
+            segments: List[List[Tuple[str, str, str]]] = [[]]
+            for tag in treetaggerwrapper.make_tags(TAGGER.tag_text(blob)):
+                if not isinstance(tag, treetaggerwrapper.Tag):
+                    if ARTWORK_SEP in str(getattr(tag, "what", "")):
+                        segments.append([])
+                    continue
+                tok = str(tag.word or "").strip()
+                if tok:
+                    lemma, pos = _lemma_pos(tag, tok)
+                    segments[-1].append((tok, pos, lemma))
+            if len(segments) == len(texts):
+                return segments, True
+        except Exception:
+            pass
+    return [tag_lyrics(t) for t in texts], False
+
+def tag_many(texts: List[str]) -> List[List[Tuple[str, str, str]]]:
+    # Ritorna [(token, pos, lemma), ...] per ogni testo, allineati a `texts`.
+    # Le descrizioni già in TAG_CACHE non vengono ritaggate; le altre sono taggate
+    # insieme in un'unica chiamata e, se prodotte dal tagger, aggiunte alla cache.
+    # Testi identici nello stesso blocco (cover, remix, riedizioni) vengono taggati una volta.
+    keys = [_tag_key(t) for t in texts]
+    cached = TAG_CACHE.get_many(set(keys)) if TAG_CACHE is not None else {}
+    results = [cached.get(k) for k in keys]
+    missing: Dict[str, List[int]] = {}  # chiave -> posizioni nel blocco
+    for i, r in enumerate(results):
+        if r is None:
+            missing.setdefault(keys[i], []).append(i)
+    if missing:
+        firsts = [pos[0] for pos in missing.values()]
+        tagged, from_tagger = _tag_many_uncached([texts[i] for i in firsts])
+        for (key, pos), tags in zip(missing.items(), tagged):
+            for i in pos:
+                results[i] = tags
+        if from_tagger and TAG_CACHE is not None:
+            TAG_CACHE.put_many(dict(zip(missing, tagged)))
+    return results
+
 def getLemma(word: str) -> str:
     # Restituisce il lemma della parola via TreeTagger.
     # In fallback (assenza/errore) ritorna la parola lowercased.
     if not word:
         return ""
-    try:
-        tags = get_tags(word)
-        if tags:
-            lemma = tags[0].lemma or ""
-            # TreeTagger talvolta usa "lemma:qualcosa": teniamo la parte prima di ':'
-            return (str(lemma).split(":")[0]) or word.lower()
-        return word.lower()
-    except Exception:
-        return word.lower()
+    return _analyze(word)[0]
 
 def getTypeOfWord(word: str) -> str:
     # Restituisce il POS di TreeTagger (stringa semplificata), o "" se non disponibile.
     if not word:
         return ""
-    try:
-        tags = get_tags(word)
-        if tags:
-            pos = tags[0].pos or ""
-            return str(pos).split(":")[0]
-        return ""
-    except Exception:
-        return ""
+    return _analyze(word)[1]
 
 # Utility POS (inglese) basate sui tag di TreeTagger
 def isNumber(word):    return getTypeOfWord(word) in ("CD", "NUM")
-def isVerb(word):      return getTypeOfWord(word).startswith("VB") if getTypeOfWord(word) else False   # VB, VBD, VBG, ...
-def isAdjective(word): return getTypeOfWord(word).startswith("JJ") if getTypeOfWord(word) else False   # JJ, JJR, JJS
-def isAdverb(word):    return getTypeOfWord(word).startswith("RB") if getTypeOfWord(word) else False   # RB, RBR, RBS
+def isVerb(word):      return getTypeOfWord(word).startswith("VB")   # VB, VBD, VBG, ...
+def isAdjective(word): return getTypeOfWord(word).startswith("JJ")   # JJ, JJR, JJS
+def isAdverb(word):    return getTypeOfWord(word).startswith("RB")   # RB, RBR, RBS
 
 # =============================================================================
 # Normalizzazione delle istanze (brani)
@@ -191,6 +477,8 @@ def to_text(value: Any) -> str:
     # - liste -> join con spazio
     # - None  -> stringa vuota
     # - altri -> str(value)
+    if type(value) is str:  # caso di gran lunga più comune: nessuna conversione
+        return value
     if isinstance(value, list):
         return " ".join(map(str, value))
     return "" if value is None else str(value)
@@ -206,19 +494,22 @@ def normalize_instance(obj: Dict[str, Any]) -> Dict[str, Any]:
     # - schema "vecchio" (descr_music_GENIUS*.json)
     # - schema "nuovo" (file __extended*.json)
     # Caso 1) già nel formato "vecchio"
+    #    (fast-path: nessun lavoro dello schema "nuovo", campi stringa presi così come sono)
     if "ID" in obj and "lyrics" in obj:
+        get = obj.get
+        id_, lyrics = obj["ID"], obj["lyrics"]
         return {
-            "ID": to_text(obj.get("ID")),
-            "title": to_text(obj.get("title")),
-            "artist": to_text(obj.get("artist")),
-            "album": to_text(obj.get("album")),
-            "year": to_text(obj.get("year")),
-            "lyrics": to_text(obj.get("lyrics")),
-            "tags": list(obj.get("tags") or []),
-            "moods": list(obj.get("moods") or []),
-            "instruments": list(obj.get("instruments") or []),
-            "subgenres": list(obj.get("subgenres") or []),
-            "contexts": list(obj.get("contexts") or []),
+            "ID": id_ if type(id_) is str else to_text(id_),
+            "title": to_text(get("title")),
+            "artist": to_text(get("artist")),
+            "album": to_text(get("album")),
+            "year": to_text(get("year")),
+            "lyrics": lyrics if type(lyrics) is str else to_text(lyrics),
+            "tags": list(get("tags") or ()),
+            "moods": list(get("moods") or ()),
+            "instruments": list(get("instruments") or ()),
+            "subgenres": list(get("subgenres") or ()),
+            "contexts": list(get("contexts") or ()),
         }
 
     # Caso 2) schema "nuovo" (extended)
@@ -263,11 +554,38 @@ def normalize_instance(obj: Dict[str, Any]) -> Dict[str, Any]:
         "contexts": contexts,
     }
 
+def load_json_file(path) -> Any:
+    # Ritorna il contenuto parsato del file (None se il file è vuoto).
+    # Nessun memo: ogni file è letto una volta per esecuzione e i dati parsati
+    # restano in memoria solo finché le sue istanze vengono consumate.
+    with open(path, "rb") as f:
+        raw = f.read()
+    if not raw.strip():
+        return None
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode(ENCODING))
+
+def _is_json_list(path) -> bool:
+    # True se il primo carattere significativo del file è '[' (lista di oggetti)
+    with open(path, "rb") as f:
+        head = f.read(4096).lstrip(b"\xef\xbb\xbf \t\r\n")
+    return head[:1] == b"["
+
 def iter_instances(input_path: Path) -> Iterable[Dict[str, Any]]:
     # Generatore di istanze normalizzate a partire da:
     # - FILE JSON: oggetto singolo o lista di oggetti
     if input_path.is_file():
-        data = json.loads(input_path.read_text(encoding=ENCODING))
+        # Lista molto grande: con ijson gli oggetti sono letti uno alla volta (memoria
+        # costante) invece di parsare tutto il file
+        if (ijson is not None and input_path.stat().st_size >= STREAM_JSON_MIN_BYTES
+                and _is_json_list(input_path)):
+            with open(input_path, "rb") as f:
+                for obj in ijson.items(f, "item", use_float=True):
+                    if isinstance(obj, dict):
+                        yield normalize_instance(obj)
+            return
+        data = load_json_file(input_path)
         if isinstance(data, dict):
             yield normalize_instance(data)
         elif isinstance(data, list):
@@ -280,20 +598,49 @@ def iter_instances(input_path: Path) -> Iterable[Dict[str, Any]]:
 
     # - DIRECTORY: tutti i file *.json (flat, non ricorsivo)
     if input_path.is_dir():
-        for jf in sorted(input_path.glob("*.json")):
+        with os.scandir(input_path) as it:
+            entries = [e for e in it if e.name.endswith(".json") and e.is_file()]
+        entries.sort(key=attrgetter("name"))
+
+        def _read_one(entry):
+            # lettura+parsing di un file; l'errore viene restituito, non sollevato,
+            # così un file corrotto non interrompe gli altri
             try:
-                text = jf.read_text(encoding=ENCODING)
-                if not text.strip():
-                    continue
-                obj = json.loads(text)
-                if isinstance(obj, dict):
-                    yield normalize_instance(obj)
-                elif isinstance(obj, list):
-                    for o in obj:
-                        if isinstance(o, dict):
-                            yield normalize_instance(o)
+                return load_json_file(entry.path), None
             except Exception as e:
-                print(f"[WARN] file JSON ignorato: {jf.name} -> {e}")
+                return None, e
+
+        def _read_ahead(ex):
+            # (entry, (dati, errore)) nell'ordine dei nomi; al più 2*READ_WORKERS file
+            # letti in anticipo (come iter_block_results), non l'intera directory
+            pending = deque()
+            for entry in entries:
+                pending.append((entry, ex.submit(_read_one, entry)))
+                if len(pending) >= 2 * READ_WORKERS:
+                    jf, fut = pending.popleft()
+                    yield jf, fut.result()
+            while pending:
+                jf, fut = pending.popleft()
+                yield jf, fut.result()
+
+        # I/O sovrapposto fra più file, istanze emesse nell'ordine dei nomi.
+        # Le istanze vengono consegnate man mano che i file sono pronti: mentre il
+        # chiamante tagga, i thread leggono/parsano i file successivi della finestra.
+        with ThreadPoolExecutor(max_workers=READ_WORKERS) as ex:
+            for jf, (obj, err) in _read_ahead(ex):
+                try:
+                    if err is not None:
+                        raise err
+                    if obj is None:
+                        continue
+                    if isinstance(obj, dict):
+                        yield normalize_instance(obj)
+                    elif isinstance(obj, list):
+                        for o in obj:
+                            if isinstance(o, dict):
+                                yield normalize_instance(o)
+                except Exception as e:
+                    print(f"[WARN] file JSON ignorato: {jf.name} -> {e}")
         return
 
     raise FileNotFoundError(f"Percorso input non trovato: {input_path}")
@@ -302,135 +649,286 @@ def iter_instances(input_path: Path) -> Iterable[Dict[str, Any]]:
 # Generazione dei prototipi (feature words + score)
 # =============================================================================
 
-def writeWordInFile(file, word, value):
-    # Scrive una riga "word: <spazi>value" con allineamento minimo
-    spaces = max(1, 20 - len(word) + 1)
-    file.write(f"{word}:{' ' * spaces}{value}\n")
-
-def insertArtworkInDict(instance: Dict[str, Any],
-                        dict_prototypes: Dict[str, Dict[str, int]],
-                        remove_words: set):
-    # Estrae i lemmi dai campi descrittivi dell'istanza e aggiorna il dizionario:
-    # dict_prototypes[artwork_id][lemma] = frequenza grezza (conteggio)
-    # Regola: associa il verbo (lemma) al sostantivo successivo come co-occorrenza leggera.
-    # -----------------------------------------------------------------------------
+def formatWordLine(word, value) -> str:
+    # Riga "word: <spazi>value": valore in colonna 23, almeno uno spazio dopo i ':'
+    return f"{word + ':':<21} {value}\n"
 
+def artwork_key(instance: Dict[str, Any]) -> str:
     # Identificatore dell'artwork: usa cfg.instanceID se presente, altrimenti fallback dallo slug
-    key_name = getattr(cfg, "instanceID", "ID")
-    artwork_id = instance.get(key_name) if isinstance(instance, dict) else None
+    artwork_id = instance.get(_ID_KEY) if isinstance(instance, dict) else None
     if not artwork_id:
         title = instance.get("title", "") or ""
         artist = instance.get("artist", "") or ""
         year = instance.get("year", "") or ""
         artwork_id = safe_slug(f"{artist}_{title}_{year}") or "artwork"
-    artwork = safe_filename(str(artwork_id))
+    return safe_filename(str(artwork_id))
 
+def artwork_description(instance: Dict[str, Any]) -> str:
     # Costruzione descrizione concatenando i campi elencati in cfg.instanceDescr (fallback default)
-    try:
-        descr_fields = list(cfg.instanceDescr)
-    except Exception:
-        descr_fields = ["title", "artist", "lyrics", "tags"]
-
-    description = " " + " ".join(
-        to_text(instance.get(d, "")) for d in descr_fields
+    return " " + " ".join(
+        to_text(instance.get(d, "")) for d in _DESCR_FIELDS
     )
 
-    # Tokenizzazione: preferisci NLTK, altrimenti split semplice
-    try:
-        word_tokens = word_tokenize(description)
-    except Exception:
-        word_tokens = description.split()
-
-    verbo = None  # memorizza l'ultimo verbo lemmatizzato in attesa di agganciarlo a un sostantivo
-
-    for word in word_tokens:
-        word = word.lower().strip()
-        if not word:
-            continue
+def iter_descriptions(input_path: Path) -> Iterable[Tuple[str, str]]:
+    # Riduce ogni istanza a (artwork, descrizione): è tutto ciò che serve a tagging e
+    # conteggi, e sono tuple leggere da raggruppare in blocchi e passare ai thread.
+    for instance in iter_instances(input_path):
+        try:
+            yield artwork_key(instance), artwork_description(instance)
+        except Exception as e:
+            print(f"[WARN] errore durante l'elaborazione di un'istanza: {e}")
 
-        # Filtra token: lunghezza >1, non stopword/funcword, non numeri, non avverbi
-        if (len(word) > 1) and (word not in remove_words) and (not isNumber(word)) and (not isAdverb(word)):
-            if isVerb(word):
-                # Memorizza lemma del verbo per il prossimo sostantivo/parola utile
-                verbo = getLemma(word)
-            else:
-                word_lemma = getLemma(word)
+# Classificazione di un token taggato per count_tagged
+KIND_SKIP, KIND_VERB, KIND_WORD = 0, 1, 2
+
+def _token_kind_for(word: str, pos: str, remove_words: frozenset) -> int:
+    # Filtra token: lunghezza >1, non stopword/funcword, non numeri/punteggiatura, non avverbi;
+    # i verbi restano in attesa del sostantivo successivo
+    if is_junk_token(word, remove_words) or pos in ("CD", "NUM") or pos.startswith("RB"):
+        return KIND_SKIP
+    return KIND_VERB if pos.startswith("VB") else KIND_WORD
+
+@lru_cache(maxsize=200_000)
+def _token_kind(word: str, pos: str) -> int:
+    # Come _token_kind_for con REMOVE_WORDS: il vocabolario dei testi è limitato, quindi
+    # ogni coppia (parola, pos) viene classificata una volta sola per esecuzione
+    # (cache svuotata da main() quando REMOVE_WORDS viene completato)
+    return _token_kind_for(word, pos, REMOVE_WORDS)
+
+def count_tagged(artwork: str,
+                 tagged: List[Tuple[str, str, str]],
+                 dict_prototypes: Dict[str, Counter],
+                 remove_words: Optional[frozenset] = None):
+    # Aggiorna dict_prototypes[artwork][lemma] = frequenza grezza (conteggio)
+    # a partire dai tag (token, pos, lemma) della descrizione dell'artwork.
+    # Regola: associa il verbo (lemma) al sostantivo successivo come co-occorrenza leggera.
+    if remove_words is None or remove_words is REMOVE_WORDS:
+        kind = _token_kind
+    else:
+        kind = lambda word, pos: _token_kind_for(word, pos, remove_words)
 
-                if artwork not in dict_prototypes:
-                    dict_prototypes[artwork] = {}
+    verbo = None  # memorizza l'ultimo verbo lemmatizzato in attesa di agganciarlo a un sostantivo
+    lemmas: List[str] = []  # lemmi da conteggiare, nell'ordine in cui compaiono
+
+    for word, pos, lemma in tagged:
+        k = kind(word, pos)
+        if k == KIND_WORD:
+            lemmas.append(lemma)
+            if verbo is not None:
+                # Aggiunge anche il verbo come feature "co-occorrenza" del sostantivo corrente
+                lemmas.append(verbo)
+                verbo = None
+        elif k == KIND_VERB:
+            # Memorizza lemma del verbo per il prossimo sostantivo/parola utile
+            verbo = lemma
+
+    if lemmas:
+        dict_prototypes.setdefault(artwork, Counter()).update(lemmas)
 
-                dict_prototypes[artwork][word_lemma] = dict_prototypes[artwork].get(word_lemma, 0) + 1
+def insertArtworkInDict(instance: Dict[str, Any],
+                        dict_prototypes: Dict[str, Counter],
+                        remove_words: Optional[frozenset] = None):
+    # Estrae i lemmi dai campi descrittivi di una singola istanza e aggiorna il dizionario
+    # (percorso per istanza; main() usa iter_descriptions + process_batch).
+    count_tagged(artwork_key(instance),
+                 tag_lyrics(artwork_description(instance)),
+                 dict_prototypes, remove_words)
+
+def iter_batches(items: Iterable[Any], size: int, key=None) -> Iterable[List[Any]]:
+    # Raggruppa uno stream in blocchi di `size` elementi (l'ultimo può essere più corto).
+    # Con key, elementi consecutivi con la stessa chiave non vengono mai divisi fra due blocchi
+    # (il blocco si allunga oltre `size` finché la chiave non cambia).
+    batch: List[Any] = []
+    for item in items:
+        if len(batch) >= size and (key is None or key(item) != key(batch[-1])):
+            yield batch
+            batch = []
+        batch.append(item)
+    if batch:
+        yield batch
+
+def process_batch(batch: List[Tuple[str, str]]) -> Tuple[Dict[str, Counter], int]:
+    # Tagga un blocco di (artwork, descrizione) con una sola chiamata TreeTagger
+    # e ne calcola i conteggi. Ritorna (prototipi parziali del blocco, numero di istanze elaborate).
+    local: Dict[str, Counter] = {}
+    n = 0
+    for (artwork, _), tagged in zip(batch, tag_many([descr for _, descr in batch])):
+        try:
+            count_tagged(artwork, tagged, local)
+            n += 1
+        except Exception as e:
+            print(f"[WARN] errore durante l'elaborazione di un'istanza: {e}")
+    return local, n
+
+def merge_prototypes(dst: Dict[str, Counter], src: Dict[str, Counter]):
+    # Somma i conteggi di src in dst (lo stesso artwork può comparire in più blocchi)
+    for artwork, counts in src.items():
+        dst.setdefault(artwork, Counter()).update(counts)
+
+def iter_block_results(batches: Iterable[List[Tuple[str, str]]]) -> Iterable[Tuple[Dict[str, Counter], int]]:
+    # Applica process_batch ai blocchi e ne restituisce i risultati nell'ordine dei blocchi
+    # (output deterministico), in parallelo se c'è un pool TreeTagger.
+    if WORKERS > 1 and TAGGER is not None:
+        # Più blocchi in volo: ogni thread attende il proprio processo TreeTagger del pool.
+        # Al più 2*WORKERS blocchi pendenti (lo stream di input non viene materializzato)
+        with ThreadPoolExecutor(max_workers=WORKERS) as ex:
+            pending = deque()
+            for batch in batches:
+                pending.append(ex.submit(process_batch, batch))
+                if len(pending) >= 2 * WORKERS:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    else:
+        for batch in batches:
+            yield process_batch(batch)
+
+def prototype_rows(counts: Counter) -> List[Tuple[str, float]]:
+    # Coppie (parola, score) ordinate per frequenza decrescente, con i punteggi
+    # normalizzati in [MIN_SCORE, MAX_SCORE]. Lista vuota se l'artwork non ha parole.
+    totWords = sum(counts.values())
+    if totWords == 0:
+        return []
 
-                if verbo is not None:
-                    # Aggiunge anche il verbo come feature "co-occorrenza" del sostantivo corrente
-                    dict_prototypes[artwork][verbo] = dict_prototypes[artwork].get(verbo, 0) + 1
-                    verbo = None
+    # Calcolo freq min/max per normalizzare i punteggi (min/max builtin sui conteggi:
+    # la divisione per totWords è monotona, quindi il risultato è identico)
+    minFreq = min(counts.values()) / totWords
+    maxFreq = max(counts.values()) / totWords
+
+    rangeFreq = maxFreq - minFreq
+    rangeScore = MAX_SCORE - MIN_SCORE
+
+    if TOP_K:
+        top = heapq.nlargest(TOP_K, counts.items(), key=itemgetter(1))
+    else:
+        top = sorted(counts.items(), key=itemgetter(1), reverse=True)
+
+    # Lo score dipende solo dal conteggio: calcolato una volta per valore distinto
+    # fra le parole scritte (con TOP_K solo quelle selezionate)
+    scores: Dict[int, float] = {}
+    for count in set(map(itemgetter(1), top)):
+        if rangeFreq == 0:
+            scores[count] = MAX_SCORE
+        else:
+            freq = count / totWords
+            scores[count] = round(MIN_SCORE + (rangeScore * (freq - minFreq) / rangeFreq), 3)
+    return [(word, scores[count]) for word, count in top]
+
+def write_prototype(out_base: str, artwork: str, counts: Counter) -> bool:
+    # Scrive <out_base><artwork>.txt con i punteggi normalizzati in [MIN_SCORE, MAX_SCORE].
+    # Ritorna False (nessun file) se l'artwork non ha parole.
+    rows = prototype_rows(counts)
+    if not rows:
+        return False
+
+    # artwork è già passato da safe_filename (artwork_key): niente altre sostituzioni
+    out_path = out_base + artwork + ".txt"
+
+    # Corpo del file costruito in memoria e scritto con una sola write
+    lines = [formatWordLine(word, score) for word, score in rows]
+    with open(out_path, "w", encoding=ENCODING) as f:
+        f.write("".join(lines))
+    return True
+
+def write_prototype_jsonl(f, artwork: str, counts: Counter) -> bool:
+    # Variante a file unico (cfg.outFormat = "jsonl"): aggiunge a f la riga
+    # {"artwork": ..., "scores": {parola: score, ...}}. False se l'artwork non ha parole.
+    rows = prototype_rows(counts)
+    if not rows:
+        return False
+    f.write(json.dumps({"artwork": artwork, "scores": dict(rows)}, ensure_ascii=False) + "\n")
+    return True
+
+def flush_prototypes(prototypes: Dict[str, Counter], ex: ThreadPoolExecutor,
+                     out_base: str, jsonl_f=None) -> int:
+    # Scrive i prototipi dati (un .txt per artwork, distribuiti sui thread di ex,
+    # oppure righe di jsonl_f). Ritorna il numero di prototipi scritti.
+    if jsonl_f is not None:
+        return sum(write_prototype_jsonl(jsonl_f, artwork, counts)
+                   for artwork, counts in prototypes.items())
+    return sum(ex.map(lambda item: write_prototype(out_base, item[0], item[1]),
+                      prototypes.items()))
 
 def main():
     # Inizializzazione componenti NLP
     ensure_nltk()
-    global TAGGER
-    try:
-        TAGGER = make_tagger()
-    except Exception as e:
-        # Fallback: procede senza lemmatizzazione/pos avanzata
-        TAGGER = None
-        print(f"[WARN] TreeTagger non inizializzato: {e}. Il processo continuerà senza lemmatizzazione avanzata.")
+    global TAGGER, NLP, STOPWORDS_EN, REMOVE_WORDS, TAG_SIGNATURE
+    if NLP_BACKEND == "spacy":
+        try:
+            NLP = make_spacy_nlp()
+        except Exception as e:
+            NLP = None
+            print(f"[WARN] spaCy non inizializzato: {e}. Uso TreeTagger.")
+    if NLP is None:
+        try:
+            TAGGER = make_tagger(WORKERS)
+        except Exception as e:
+            # Fallback: procede senza lemmatizzazione/pos avanzata
+            TAGGER = None
+            print(f"[WARN] TreeTagger non inizializzato: {e}. Il processo continuerà senza lemmatizzazione avanzata.")
 
     # Costruzione set di parole da rimuovere (stopword + liste funzionali)
     try:
-        stop_words = set(stopwords.words('english'))
+        STOPWORDS_EN = frozenset(stopwords.words('english'))
     except Exception:
-        stop_words = set()
-    remove_words = set(PREPOSITIONS + ARTICLES + CONJUNCTIONS + PUNCTUATION + list(stop_words))
+        STOPWORDS_EN = frozenset()
+    REMOVE_WORDS = FUNCTION_WORDS | STOPWORDS_EN
+    _token_kind.cache_clear()  # classificazioni calcolate con il REMOVE_WORDS precedente
 
     # Path input/output
     input_path = resolve_input_path()
     out_dir    = resolve_output_dir()
-
-    # Costruzione prototipi (conteggi per artwork)
-    dict_prototypes: Dict[str, Dict[str, int]] = {}
+    tag_cache_path = resolve_tag_cache_path()
+    TAG_SIGNATURE = tagger_signature() if tag_cache_path is not None else ""
+    load_tag_cache(tag_cache_path)
+
+    # Costruzione prototipi (conteggi per artwork) e scrittura: uno per artwork (<artwork>.txt)
+    # o una riga di prototypes.jsonl, con punteggi normalizzati in [MIN_SCORE, MAX_SCORE].
+    # Con STREAM_WRITE ogni blocco è scritto e liberato appena elaborato: i conteggi
+    # occupano memoria solo per i blocchi in volo (più gli ID già scritti in `flushed`).
+    # L'input resta in memoria solo per la finestra di file letti in anticipo (cartella)
+    # o per intero se è un unico file JSON (in streaming solo con ijson e file molto
+    # grandi). Senza STREAM_WRITE i conteggi si accumulano e si scrivono alla fine,
+    # unendo anche gli ID ripetuti in blocchi diversi.
+    # In streaming i blocchi non spezzano istanze consecutive con lo stesso ID (es. le
+    # varianti __extended_N di un brano, adiacenti nella cartella ordinata): vengono
+    # unite; un ID che ricompare più avanti, già scritto, è scartato con un warning.
+    dict_prototypes: Dict[str, Counter] = {}
+    flushed: set = set()  # artwork già scritti (solo STREAM_WRITE)
     n_items = 0
-    for instance in iter_instances(input_path):
-        try:
-            insertArtworkInDict(instance, dict_prototypes, remove_words)
-            n_items += 1
-        except Exception as e:
-            print(f"[WARN] errore durante l'elaborazione di un'istanza: {e}")
-
-    # Scrittura file: uno per artwork (<artwork>.txt) con punteggi normalizzati in [MIN_SCORE, MAX_SCORE]
     written = 0
-    for artwork, counts in dict_prototypes.items():
-        totWords = sum(counts.values())
-        if totWords == 0:
-            continue
+    out_base = str(out_dir) + os.sep  # prefisso calcolato una volta: niente Path per ogni artwork
+    batches = iter_batches(iter_descriptions(input_path), TAG_BATCH,
+                           key=itemgetter(0) if STREAM_WRITE else None)
 
-        # Calcolo freq min/max per normalizzare i punteggi
-        minFreq, maxFreq = 1.0, 0.0
-        for cnt in counts.values():
-            freq = cnt / totWords
-            if freq < minFreq: minFreq = freq
-            if freq > maxFreq: maxFreq = freq
-
-        rangeFreq = maxFreq - minFreq
-        rangeScore = MAX_SCORE - MIN_SCORE
-
-        # Filename sicuro (sostituisce apostrofi per evitare problemi)
-        safe_name = artwork.replace("'", "_")
-        out_path = out_dir / f"{safe_name}.txt"
-
-        with out_path.open("w", encoding=ENCODING) as f:
-            for word, count in sorted(counts.items(), key=lambda kv: kv[1], reverse=True):
-                freq = count / totWords
-                if rangeFreq == 0:
-                    score = MAX_SCORE
-                else:
-                    score = MIN_SCORE + (rangeScore * (freq - minFreq) / rangeFreq)
-                writeWordInFile(f, word, round(score, 3))
-        written += 1
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as wex, \
+         (open(out_dir / JSONL_NAME, "w", encoding=ENCODING, buffering=1 << 20)
+          if OUT_FORMAT == "jsonl" else nullcontext()) as jsonl_f:
+        try:
+            for local, n in iter_block_results(batches):
+                n_items += n
+                if not STREAM_WRITE:
+                    merge_prototypes(dict_prototypes, local)
+                    continue
+                for artwork in flushed.intersection(local):
+                    print(f"[WARN] artwork ripetuto dopo la scrittura, ignorato: {artwork}")
+                    del local[artwork]
+                flushed.update(local)
+                written += flush_prototypes(local, wex, out_base, jsonl_f)
+        finally:
+            # TaggerPoll: i thread/processi del pool vanno chiusi esplicitamente
+            if hasattr(TAGGER, "stop_poll"):
+                TAGGER.stop_poll()
+            save_tag_cache(tag_cache_path)
+
+        if not STREAM_WRITE:
+            written = flush_prototypes(dict_prototypes, wex, out_base, jsonl_f)
 
     print(f"Processed items: {n_items}")
-    print(f"File generated in {out_dir} (written {written} files)")
+    if OUT_FORMAT == "jsonl":
+        print(f"File generated: {out_dir / JSONL_NAME} ({written} artworks)")
+    else:
+        print(f"File generated in {out_dir} (written {written} files)")
 
 if __name__ == "__main__":
     main()
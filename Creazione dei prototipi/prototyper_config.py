@@ -15,3 +15,21 @@ instanceDescr = [
 
 # output folder path
 outPath = r"Creazione dei prototipi\music_for_cocos"
+
+# output format: "txt" = one <artwork>.txt per prototype (read by cocos), "jsonl" = single prototypes.jsonl
+outFormat = "txt"
+
+# write each block of prototypes as soon as it is counted (low memory). Instances sharing an ID must be
+# adjacent in the input (they are merged); an ID that appears again later is skipped with a warning.
+# False (default) = keep all counts and merge repeated IDs anywhere before writing
+streamWrite = False
+
+# POS/lemma backend: "treetagger" (default) or "spacy" (needs spacy + en_core_web_sm; falls back to TreeTagger)
+nlpBackend = "treetagger"
+
+# max number of words written per prototype file (most frequent first); None = all
+topK = None
+
+# persistent tag cache (SQLite, tags per description and tagger configuration) reused across runs,
+# e.g. r"Creazione dei prototipi\cache_tags.sqlite"; only point it to a local file you trust. None = disabled
+tagCachePath = None
@@ -1,7 +1,24 @@
-import argparse, json, re, math
-from collections import defaultdict, Counter
+import argparse, json, re, math, heapq
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from operator import itemgetter
 from pathlib import Path
 
+# ijson (opzionale): lettura in streaming dell'input, una traccia alla volta.
+# Senza ijson si ricade su json.load dell'intero file.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# orjson (opzionale): parsing più veloce quando l'input si legge tutto in una volta
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # MACRO_GENRES:
 #   L’insieme dei macro-generi che il sistema riconosce
 #   Indicizzare i brani per genere
@@ -120,10 +137,16 @@ def is_stop_en(t:str)->bool:
 #   - filtra stopword e token < 3 caratteri
 # ↑ Se aumenta la qualità di lyrics (meno rumore), si può ridurre il filtro;
 # ↓ Se lyrics sono rumorose, conviene tenerlo com’è o inasprire la stoplist.
+#   (normalizzazione + filtro memoizzati per token grezzo: nelle lyrics le stesse parole
+#    si ripetono moltissimo, quindi ogni forma distinta viene elaborata una sola volta)
+@lru_cache(maxsize=200_000)
+def _useful_word(raw:str):
+    t = norm_token(raw)
+    return t if len(t)>=3 and not is_stop_en(t) else None
+
 def extract_words(text:str):
     if not text: return []
-    toks = [norm_token(m.group()) for m in TOKEN_RE.finditer(text)]
-    return [t for t in toks if len(t)>=3 and not is_stop_en(t)]
+    return [t for t in map(_useful_word, TOKEN_RE.findall(text)) if t is not None]
 
 # Determina i macro-generi per un brano “entry”:
 #   - guarda subgenres e tags (mappati via SUB2MACRO),
@@ -141,9 +164,106 @@ def choose_macrogenres(entry):
         if k in blob: out.add(v)
     return [g for g in out if g in MACRO_GENRES]
 
+# Itera le tracce del file di input (lista di tracce oppure oggetto {"tracks": [...]}):
+#   - con ijson: streaming → in memoria c'è una traccia alla volta, non l'intero file
+#   - senza: parsing dell'intero file (orjson se presente, altrimenti json)
+def iter_tracks(path):
+    if ijson is not None:
+        with open(path,"rb") as f:
+            head = f.read(4096).lstrip(b"\xef\xbb\xbf \t\r\n")[:1]
+            f.seek(0)
+            prefix = "item" if head == b"[" else "tracks.item"
+            yield from ijson.items(f, prefix, use_float=True)
+        return
+    if orjson is not None: data = orjson.loads(Path(path).read_bytes())
+    else:                  data = json.load(open(path,"r",encoding="utf-8"))
+    if isinstance(data, dict) and "tracks" in data: data = data["tracks"]
+    yield from data
+
 # Clippa un valore nel range [MIN_W, MAX_W] (usato dopo la normalizzazione dei typical).
 def clamp(x,lo=MIN_W,hi=MAX_W): return max(lo,min(hi,x))
 
+# “IDF” semplificato su generi:
+#   Più un tratto appare in molti generi, più cresce gcount → più cresce il denominatore
+#   nella parte di specificità → riduce l’impatto della proprietà (meno distintiva).
+#   gcount vale al più len(MACRO_GENRES): i log sono precalcolati una volta per valore.
+IDF_BY_GCOUNT = [math.log(1 + (1 + c)) for c in range(len(MACRO_GENRES) + 1)]
+def idf_prop(p:str, global_genre_count)->float:
+    return IDF_BY_GCOUNT[global_genre_count.get(p,0)]
+
+# Costruisce e scrive typical/<g>.txt e rigid/<g>.txt per un genere.
+#   Funzione top-level (picklabile): i generi sono indipendenti e con --workers > 1
+#   vengono elaborati in parallelo da processi distinti.
+def build_genre(g, tag_df, word_df, n_docs, global_genre_count, args, typ_dir, rig_dir):
+    # Nessun brano per questo genere → file vuoti
+    if n_docs == 0:
+        (typ_dir/f"{g}.txt").write_text("", encoding="utf-8")
+        (rig_dir/f"{g}.txt").write_text("", encoding="utf-8")
+        return
+
+    # Frazione (0..1) di brani del genere che contengono ciascun tag/parola
+    #   (items() + variabili locali: nessuna lookup ripetuta dei dict per genere)
+    min_df = args.min_df_words
+    frac_tag  = {t: c/n_docs for t,c in tag_df.items()}
+    frac_word = {w: c/n_docs for w,c in word_df.items() if c >= min_df}
+
+    # Selezione “raw” dei typical: sopra soglia
+    #   NB: per le parole, scartiamo i “globaloni” se NON sono nel DOMAIN_WHITELIST.
+    typical_tags_raw  = {t:v for t,v in frac_tag.items()  if v >= args.typical_thr_tags}
+    typical_words_raw = {w:v for w,v in frac_word.items()
+                         if v >= args.typical_thr_words and not (w in COMMON_GLOBAL and w not in DOMAIN_WHITELIST)}
+
+    # Scoring delle proprietà typical:
+    #   combinazione di prevalenza (v) e specificità (v / idf_prop)
+    #   con peso ALPHA; per le parole applichiamo anche un 0.8 per prudenza.
+    #   (dict semplice: i tag sono chiavi distinte, solo le parole possono sommarsi a un tag)
+    scores = {t: ALPHA*v + (1-ALPHA)*(v / idf_prop(t, global_genre_count))
+              for t,v in typical_tags_raw.items()}
+    for w_,v in typical_words_raw.items():
+        w = (ALPHA*v + (1-ALPHA)*(v / idf_prop(w_, global_genre_count))) * 0.8
+        scores[w_] = scores.get(w_, 0) + w
+
+    # Penalità/Boost:
+    #   - penalizza i globaloni (COMMON_PENALTY)
+    #   - boosta le proprietà distintive (DISTINCTIVE_BOOST)
+    for p,s in scores.items():
+        if p in COMMON_GLOBAL: s *= COMMON_PENALTY
+        if global_genre_count.get(p,99) <= DISTINCTIVE_MAX_GENRES: s *= DISTINCTIVE_BOOST
+        scores[p] = s
+
+    # Prendi le top-k proprietà con score più alto
+    #   (come Counter.most_common: nlargest stabile sui pari merito)
+    top_items = dict(heapq.nlargest(args.topk_typical, scores.items(), key=itemgetter(1)))
+
+    # Normalizzazione nel range [MIN_W, MAX_W] → pesi finali “typical”
+    if top_items:
+        mn, mx = min(top_items.values()), max(top_items.values())
+        for p,v in list(top_items.items()):
+            if mx == mn: w = 0.80              # caso degenerato: tutti uguali
+            else:        w = MIN_W + (v - mn) / (mx - mn) * (MAX_W - MIN_W)
+            top_items[p] = clamp(round(w,3))
+
+    # Scelta RIGID (ancore):
+    #   - tag sopra rigid_thr_tags
+    #   - parole sopra rigid_thr_words MA solo se in DOMAIN_WHITELIST
+    #   - limita a max_rigid (ordine di apparizione)
+    #   (candidati generati in modo lazy: ci si ferma ai primi max_rigid distinti)
+    candidates = chain((t for t,v in frac_tag.items()  if v >= args.rigid_thr_tags),
+                       (w for w,v in frac_word.items() if v >= args.rigid_thr_words and w in DOMAIN_WHITELIST))
+    rigid, seen = [], set()
+    for k in candidates:
+        if len(rigid) >= args.max_rigid: break
+        if k not in seen:
+            seen.add(k); rigid.append(k)
+
+    # Scrittura file di output:
+    #   typical/<genere>.txt  → "prop: peso"
+    #   rigid/<genere>.txt    → "prop" (una per riga)
+    #   (contenuto costruito in memoria e scritto con una sola write per file)
+    typ_lines = [f"{k}: {v}\n" for k,v in sorted(top_items.items(), key=lambda kv:(-kv[1],kv[0]))]
+    (typ_dir/f"{g}.txt").write_text("".join(typ_lines), encoding="utf-8")
+    (rig_dir/f"{g}.txt").write_text("".join(f"{k}\n" for k in rigid), encoding="utf-8")
+
 # ================================
 # MAIN: COSTRUZIONE TYPICAL/RIGID
 # ================================
@@ -191,6 +311,10 @@ def main():
     # ↑ Aumentare max_rigid: più ancore (mixing più facile, ma rischia over-constrain).
     ap.add_argument("--topk_typical", type=int, default=5)
     ap.add_argument("--max_rigid",    type=int, default=3)
+    # workers:
+    #   Processi per il calcolo per-genere (1 = sequenziale). Conviene alzarlo solo su
+    #   vocabolari grandi: l'avvio dei processi costa più del calcolo su corpora piccoli.
+    ap.add_argument("--workers", type=int, default=1)
     args = ap.parse_args()
 
     # Cartelle di output (create se non esistono)
@@ -198,113 +322,42 @@ def main():
     typ_dir = out_dir/"typical"; typ_dir.mkdir(parents=True, exist_ok=True)
     rig_dir = out_dir/"rigid";   rig_dir.mkdir(parents=True, exist_ok=True)
 
-    # Caricamento dati:
-    #   Accetta sia una lista di tracce che un oggetto {"tracks": [...]}
-    data = json.load(open(args.input,"r",encoding="utf-8"))
-    if isinstance(data, dict) and "tracks" in data: data = data["tracks"]
-
-    # Partiziona le tracce per macro-genere (ogni brano può contribuire a più generi)
-    songs_by_genre = defaultdict(list)
-    for e in data:
-        for g in choose_macrogenres(e):
-            songs_by_genre[g].append(e)
-
     # Contatori: per ogni genere calcoliamo DF (document frequency) di tag e parole
     tag_df_by_g = {g: Counter() for g in MACRO_GENRES}
     word_df_by_g= {g: Counter() for g in MACRO_GENRES}
-    n_docs_g    = {g: len(songs_by_genre[g]) for g in MACRO_GENRES}
+    n_docs_g    = {g: 0 for g in MACRO_GENRES}
 
-    # Costruzione DF per genere:
+    # Caricamento dati + costruzione DF per genere in un solo passaggio:
+    #   accetta sia una lista di tracce che un oggetto {"tracks": [...]} (vedi iter_tracks);
+    #   ogni brano può contribuire a più generi e viene scartato appena contato.
     #   - TAG: set per brano (niente duplicati intra-brano)
     #   - WORD: set delle parole estratte dalle lyrics
-    for g,songs in songs_by_genre.items():
-        for e in songs:
-            tags  = set(norm_token(t) for t in (e.get("tags") or []))
-            words = set(extract_words(e.get("lyrics","")))
+    for e in iter_tracks(args.input):
+        genres = choose_macrogenres(e)
+        if not genres: continue
+        tags  = set(map(norm_token, e.get("tags") or []))
+        words = set(extract_words(e.get("lyrics","")))
+        for g in genres:
+            n_docs_g[g] += 1
             tag_df_by_g[g].update(tags)
             word_df_by_g[g].update(words)
 
     # Conteggio “cross-genere”:
     #   Quanti generi contengono una certa proprietà (serve per specificità/IDF-like)
+    #   (update su insiemi di chiavi: il conteggio gira in C, non in un loop Python)
     global_genre_count = Counter()
     for g in MACRO_GENRES:
-        props = set(tag_df_by_g[g]) | set(word_df_by_g[g])
-        for p in props: global_genre_count[p] += 1
-
-    # “IDF” semplificato su generi:
-    #   Più un tratto appare in molti generi, più cresce gcount → più cresce il denominatore
-    #   nella parte di specificità → riduce l’impatto della proprietà (meno distintiva).
-    def idf_prop(p:str)->float:
-        gcount = global_genre_count.get(p,0)
-        return math.log(1 + (1 + gcount))
+        global_genre_count.update(tag_df_by_g[g].keys() | word_df_by_g[g].keys())
 
     # LOOP sui generi per produrre i file typical/rigid
-    for g in MACRO_GENRES:
-        # Nessun brano per questo genere → file vuoti
-        if n_docs_g[g] == 0:
-            (typ_dir/f"{g}.txt").write_text("", encoding="utf-8")
-            (rig_dir/f"{g}.txt").write_text("", encoding="utf-8")
-            continue
-
-        # Frazione (0..1) di brani del genere che contengono ciascun tag/parola
-        frac_tag  = {t: tag_df_by_g[g][t]/n_docs_g[g] for t in tag_df_by_g[g]}
-        frac_word = {w: word_df_by_g[g][w]/n_docs_g[g]
-                     for w in word_df_by_g[g] if word_df_by_g[g][w] >= args.min_df_words}
-
-        # Selezione “raw” dei typical: sopra soglia
-        #   NB: per le parole, scartiamo i “globaloni” se NON sono nel DOMAIN_WHITELIST.
-        typical_tags_raw  = {t:v for t,v in frac_tag.items()  if v >= args.typical_thr_tags}
-        typical_words_raw = {w:v for w,v in frac_word.items()
-                             if v >= args.typical_thr_words and not (w in COMMON_GLOBAL and w not in DOMAIN_WHITELIST)}
-
-        # Scoring delle proprietà typical:
-        #   combinazione di prevalenza (v) e specificità (v / idf_prop)
-        #   con peso ALPHA; per le parole applichiamo anche un 0.8 per prudenza.
-        scores = Counter()
-        for t,v in typical_tags_raw.items():
-            w = ALPHA*v + (1-ALPHA)*(v / idf_prop(t))
-            scores[t] += w
-        for w_,v in typical_words_raw.items():
-            w = (ALPHA*v + (1-ALPHA)*(v / idf_prop(w_))) * 0.8
-            scores[w_] += w
-
-        # Penalità/Boost:
-        #   - penalizza i globaloni (COMMON_PENALTY)
-        #   - boosta le proprietà distintive (DISTINCTIVE_BOOST)
-        for p in list(scores.keys()):
-            s = scores[p]
-            if p in COMMON_GLOBAL: s *= COMMON_PENALTY
-            if global_genre_count.get(p,99) <= DISTINCTIVE_MAX_GENRES: s *= DISTINCTIVE_BOOST
-            scores[p] = s
-
-        # Prendi le top-k proprietà con score più alto
-        top_items = dict(scores.most_common(args.topk_typical))
-
-        # Normalizzazione nel range [MIN_W, MAX_W] → pesi finali “typical”
-        if top_items:
-            mn, mx = min(top_items.values()), max(top_items.values())
-            for p,v in list(top_items.items()):
-                if mx == mn: w = 0.80              # caso degenerato: tutti uguali
-                else:        w = MIN_W + (v - mn) / (mx - mn) * (MAX_W - MIN_W)
-                top_items[p] = clamp(round(w,3))
-
-        # Scelta RIGID (ancore):
-        #   - tag sopra rigid_thr_tags
-        #   - parole sopra rigid_thr_words MA solo se in DOMAIN_WHITELIST
-        #   - limita a max_rigid (ordine di apparizione)
-        rigid = []
-        rigid += [t for t,v in frac_tag.items()  if v >= args.rigid_thr_tags]
-        rigid += [w for w,v in frac_word.items() if v >= args.rigid_thr_words and w in DOMAIN_WHITELIST]
-        rigid = list(dict.fromkeys(rigid))[:args.max_rigid]
-
-        # Scrittura file di output:
-        #   typical/<genere>.txt  → "prop: peso"
-        #   rigid/<genere>.txt    → "prop" (una per riga)
-        with open(typ_dir/f"{g}.txt","w",encoding="utf-8") as f:
-            for k,v in sorted(top_items.items(), key=lambda kv:(-kv[1],kv[0])):
-                f.write(f"{k}: {v}\n")
-        with open(rig_dir/f"{g}.txt","w",encoding="utf-8") as f:
-            for k in rigid: f.write(f"{k}\n")
+    #   (in parallelo su più processi se --workers > 1; ogni genere scrive i propri file)
+    jobs = [(g, tag_df_by_g[g], word_df_by_g[g], n_docs_g[g], global_genre_count, args, typ_dir, rig_dir)
+            for g in MACRO_GENRES]
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(jobs))) as ex:
+            list(ex.map(build_genre, *zip(*jobs)))
+    else:
+        for job in jobs: build_genre(*job)
 
     print("Done. Generated typical/ and rigid/ from", Path(args.input).name)
 
@@ -6,10 +6,11 @@ class ReadAttributes:
     def __init__(self, path='Input'):
 
         with open(path, encoding="utf-8") as f:
-            self.input_lines = f.readlines()
+            self.input_lines = f.read().splitlines()
 
-        self.input_lines = [x.strip() for x in self.input_lines
-                            if x.strip() != '' and x.strip()[0] != '#']
+        # strip una sola volta per riga; scarta righe vuote e commenti
+        stripped = (x.strip() for x in self.input_lines)
+        self.input_lines = [x for x in stripped if x and x[0] != '#']
 
         self.title = self.input_lines[0].split(':')[1].strip()
         self.input_lines.pop(0)
@@ -11,15 +11,13 @@
 #(default folder is ../prototipi)
 
 folder=${1:-../prototipi}
-prototypes=( `ls ${folder}` )
 
 #clears resume files
 rm recommendations.tsv
 rm resume.tsv
 
-#runs Recommender on each prototype
-for (( i = 0 ; i < ${#prototypes[@]} ; i += 1 )) ; do
-    python3 Recommender.py ${folder}/${prototypes[$i]}
-done
+#runs Recommender on all prototypes (.txt files of the folder) in a single call
+#(the dataset is loaded and indexed once and shared by every prototype)
+python3 Recommender.py "${folder}"
 
 python3 count.py
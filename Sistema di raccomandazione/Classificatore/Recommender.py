@@ -6,6 +6,21 @@ import os
 import json
 import argparse
 
+try:
+    import ahocorasick  # opzionale (pyahocorasick): un solo passaggio per istanza su tutte le proprietà
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson  # opzionale: lettura/scrittura JSON più veloce
+except ImportError:
+    orjson = None
+
+try:
+    import ijson  # opzionale: lettura del dataset in streaming, un'istanza alla volta
+except ImportError:
+    ijson = None
+
 import Recommender_config as cfg
 from DataFromInput import *  # ReadAttributes
 
@@ -20,6 +35,31 @@ def contains_word(s, w):
     w = " " + str(w) + " "
     return (w in s) or ((" " + str(w) + ",") in s)
 
+def word_form(w):
+    # Forma cercata da contains_word: " p ". La seconda forma ("  p ,", costruita
+    # sulla w già racchiusa fra spazi) contiene sempre " p ", quindi non aggiunge match
+    return " " + str(w) + " "
+
+def is_simple_word(w):
+    # True se w è una parola singola non vuota (nessuno spazio)
+    w = str(w)
+    return bool(w) and " " not in w
+
+def build_matcher(forms):
+    # Automa Aho-Corasick sulle forme date [(forma, indice), ...].
+    # Valore di ogni forma: tupla degli indici che la cercano.
+    # None se pyahocorasick non è installato o non ci sono forme.
+    if ahocorasick is None or not forms:
+        return None
+    keys = {}
+    for k, i in forms:
+        keys.setdefault(k, []).append(i)
+    automaton = ahocorasick.Automaton()
+    for k, idx in keys.items():
+        automaton.add_word(k, tuple(idx))
+    automaton.make_automaton()
+    return automaton
+
 def contains_value(lista, w):
     for p in lista:
         if str(p[0]) == w:
@@ -79,11 +119,89 @@ def build_clean_prototype(f):
             clean.append((name, True))
     return clean, set(anchors)
 
+# --- corpus: istanze pre-elaborate una volta, condivise fra più prototipi ---
+def iter_instances():
+    # con ijson (e dataset = lista di istanze) in memoria c'è un'istanza alla volta;
+    # altrimenti parsing dell'intero file (orjson se presente, altrimenti json)
+    if ijson is not None:
+        with open(cfg.jsonDescrFile, "rb") as json_file:
+            head = json_file.read(4096).lstrip(b"\xef\xbb\xbf \t\r\n")[:1]
+            json_file.seek(0)
+            if head == b"[":
+                yield from ijson.items(json_file, "item", use_float=True)
+                return
+    if orjson is not None:
+        with open(cfg.jsonDescrFile, "rb") as json_file:
+            data = orjson.loads(json_file.read())
+    else:
+        with open(cfg.jsonDescrFile, encoding="utf-8") as json_file:
+            data = json.load(json_file)
+    if isinstance(data, dict):
+        data = [data]
+    yield from data
+
+def build_corpus(data):
+    # Istanze con ID memorizzate per colonne (liste parallele, posizione = istanza):
+    #   ids, titles, artists: dati del report
+    #   texts: testi dei campi racchiusi fra spazi; del resto dell'istanza non si tiene nulla
+    # index: indice invertito token -> posizioni; token = elementi di testo.split(" "),
+    #        quindi " p " compare in un campo sse p è nell'indice
+    # I token di ogni istanza sono calcolati una sola volta, al caricamento
+    fields = cfg.instanceDescr + cfg.instanceTitle
+    title_field = cfg.instanceTitle[0]
+    ids, titles, artists, texts_col, index = [], [], [], [], {}
+    total = 0
+    for instance in data:
+        total += 1
+        inst_id = as_text(instance.get(cfg.instanceID, ""))
+        if not inst_id:
+            continue
+        texts = [" " + as_text(instance[fld]) + " " for fld in fields if fld in instance]
+        pos = len(ids)
+        ids.append(inst_id)
+        titles.append(instance.get(title_field, ""))
+        artists.append(instance.get("artist", ""))
+        texts_col.append(texts)
+        tokens = set()
+        for t in texts:
+            tokens.update(t.split(" "))
+        for tok in tokens:
+            index.setdefault(tok, []).append(pos)
+    return {"total": total, "ids": ids, "titles": titles, "artists": artists,
+            "texts": texts_col, "index": index}
+
+def scan_forms(texts_col, forms, hits):
+    # Cerca per sottostringa le forme [(forma, indice)] nei campi di tutte le istanze
+    # e aggiunge la posizione a hits[indice] (una scansione con l'automa se c'è)
+    if not forms:
+        return
+    matcher = build_matcher(forms)
+    for pos, texts in enumerate(texts_col):
+        if matcher is not None:
+            # campi separati da "\n": nessuna forma può attraversare due campi
+            for _, idx in matcher.iter("\n".join(texts)):
+                for i in idx:
+                    hits[i].add(pos)
+        else:
+            for k, i in forms:
+                if any(k in t for t in texts):
+                    hits[i].add(pos)
+
+def resolve_hits(corpus, forms):
+    # Per ogni proprietà [(p, " p ", simple)] l'insieme delle posizioni delle
+    # istanze in cui compare (stesse regole di contains_word, campo per campo):
+    #   - parole singole: lookup nell'indice dei token
+    #   - proprietà con spazi (o vuote): ricerca per sottostringa su tutte le istanze
+    hits = [set(corpus["index"].get(p, ())) if simple else set() for p, _, simple in forms]
+    full = [(w, i) for i, (_, w, simple) in enumerate(forms) if not simple]
+    scan_forms(corpus["texts"], full, hits)
+    return hits
+
 # --- core ---
 def elaboraGraduatoria(category, prop_list, anchors_set,
                        not_prop_list=None,
                        min_match_rate=0.15, min_anchors=1, max_print=None,
-                       json_outfile=None):
+                       json_outfile=None, corpus=None):
     if not_prop_list:
         not_prop_list = [p for p in not_prop_list if p]
     else:
@@ -91,51 +209,50 @@ def elaboraGraduatoria(category, prop_list, anchors_set,
 
     results_out = []
 
-    with open(cfg.jsonDescrFile, encoding="utf-8") as json_file:
-        data = json.load(json_file)
-        if isinstance(data, dict):
-            data = [data]
+    if corpus is None:
+        corpus = build_corpus(iter_instances())
 
-    tot_items = len(data)
+    tot_items = corpus["total"]
     printed = 0
 
-    # scorri istanze
-    for instance in data:
-        inst_id = as_text(instance.get(cfg.instanceID, ""))
-        if not inst_id:
-            continue
+    # forme cercate (come contains_word) risolte sull'indice una volta per prototipo:
+    # hits[i] = istanze che contengono la proprietà i; le negate seguono le positive
+    prop_names = [p for p, _ in prop_list]
+    forms = [(str(p), word_form(p), is_simple_word(p)) for p in prop_names + not_prop_list]
+    hits = resolve_hits(corpus, forms)
+    neg_positions = set().union(*hits[len(prop_names):])
 
-        matches = []
-        anchor_hits = set()
-        for prop_name, _ in prop_list:
-            in_hit = False
-            for fld in cfg.instanceDescr + cfg.instanceTitle:
-                if fld in instance and contains_word(instance[fld], prop_name):
-                    in_hit = True
-                    break
-            if in_hit:
-                matches.append(prop_name)
-                if prop_name in anchors_set:
-                    anchor_hits.add(prop_name)
-
-        neg_hit = False
-        for prop in not_prop_list:
-            for fld in cfg.instanceDescr + cfg.instanceTitle:
-                if fld in instance and contains_word(instance[fld], str(prop)):
-                    neg_hit = True
-                    break
-            if neg_hit:
-                break
+    # match per istanza ribaltando hits (solo le istanze che contengono qualcosa)
+    matches_by_pos = {}
+    for p, h in zip(prop_names, hits):
+        for pos in h:
+            matches_by_pos.setdefault(pos, []).append(p)
+
+    # invarianti del ciclo
+    min_matches = int(len(prop_list) * min_match_rate)
 
-        enough_coverage = (len(matches) >= int(len(prop_list) * min_match_rate))
-        enough_anchors = (len(anchor_hits) >= min_anchors)
+    # scorri istanze: se serve almeno un match (copertura o ancore) bastano le istanze
+    # con qualche hit, in ordine di dataset (valutazione sparsa, come una matrice
+    # termini-documenti per vettore query); altrimenti tutte
+    ids, titles, artists = corpus["ids"], corpus["titles"], corpus["artists"]
+    if min_matches > 0 or min_anchors > 0:
+        candidates = sorted(matches_by_pos)
+    else:
+        candidates = range(len(ids))
+    for pos in candidates:
+        if pos in neg_positions:
+            continue
+        matches = matches_by_pos.get(pos, [])
+        if len(matches) < min_matches:
+            continue
+        anchor_hits = {p for p in matches if p in anchors_set}
 
-        if not neg_hit and enough_coverage and enough_anchors:
+        if len(anchor_hits) >= min_anchors:
             printed += 1
             results_out.append({
-                "id": inst_id,
-                "title": instance.get(cfg.instanceTitle[0], ""),
-                "artist": instance.get("artist", ""),
+                "id": ids[pos],
+                "title": titles[pos],
+                "artist": artists[pos],
                 "matches": sorted(matches),
                 "anchors_hit": sorted(list(anchor_hits))
             })
@@ -144,15 +261,20 @@ def elaboraGraduatoria(category, prop_list, anchors_set,
 
     # --- salva JSON ---
     if json_outfile:
-        with open(json_outfile, "w", encoding="utf-8") as f:
-            json.dump({
-                "category": category,
-                "prototype": [p[0] for p in prop_list],
-                "anchors": list(anchors_set),
-                "results": results_out,
-                "classified": printed,
-                "total": tot_items
-            }, f, indent=2, ensure_ascii=False)
+        report = {
+            "category": category,
+            "prototype": [p[0] for p in prop_list],
+            "anchors": list(anchors_set),
+            "results": results_out,
+            "classified": printed,
+            "total": tot_items
+        }
+        if orjson is not None:
+            with open(json_outfile, "wb") as f:
+                f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+        else:
+            with open(json_outfile, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
 
     # --- stampa breve ---
     if printed == 0:
@@ -165,30 +287,47 @@ def elaboraGraduatoria(category, prop_list, anchors_set,
 if __name__ == '__main__':
     if len(sys.argv) >= 2:
         parser = argparse.ArgumentParser(add_help=False)
+        # uno o più prototipi (file .txt o cartelle che li contengono): il dataset viene
+        # letto e indicizzato una volta sola e condiviso fra tutti
+        parser.add_argument("prototypes", nargs="+")
         parser.add_argument("--min-match-rate", type=float, default=0.15)
         parser.add_argument("--min-anchors", type=int, default=1)
         parser.add_argument("--max-print", type=int, default=None)
-        args, rest = parser.parse_known_args(sys.argv[2:])
+        args, rest = parser.parse_known_args(sys.argv[1:])
 
-        prototipo = sys.argv[1]
-        category = os.path.basename(prototipo)
+        prototipi = []
+        for path in args.prototypes:
+            if os.path.isdir(path):
+                prototipi += sorted(os.path.join(path, fn) for fn in os.listdir(path) if fn.endswith(".txt"))
+            else:
+                prototipi.append(path)
 
-        f = ReadAttributes(prototipo)
-        prop_list, anchors_set = build_clean_prototype(f)
+        corpus = build_corpus(iter_instances())
 
-        # salva output in JSON accanto al file del prototipo
-        out_json = prototipo.replace(".txt", "_recommendations.json")
+        for prototipo in prototipi:
+            category = os.path.basename(prototipo)
+            # un prototipo illeggibile non deve fermare gli altri (prima ognuno girava in un processo a sé)
+            try:
+                f = ReadAttributes(prototipo)
+                prop_list, anchors_set = build_clean_prototype(f)
 
-        not_prop_list = []
-        for p in f.attrs:
-            nm = take_name(p)
-            if nm.startswith("-"):
-                not_prop_list.append(nm.replace("-", "").strip())
-
-        elaboraGraduatoria(category, prop_list, anchors_set, not_prop_list,
-                           min_match_rate=args.min_match_rate,
-                           min_anchors=args.min_anchors,
-                           max_print=args.max_print,
-                           json_outfile=out_json)
+                # salva output in JSON accanto al file del prototipo
+                out_json = prototipo.replace(".txt", "_recommendations.json")
+
+                not_prop_list = []
+                for p in f.attrs:
+                    nm = take_name(p)
+                    if nm.startswith("-"):
+                        not_prop_list.append(nm.replace("-", "").strip())
+
+                elaboraGraduatoria(category, prop_list, anchors_set, not_prop_list,
+                                   min_match_rate=args.min_match_rate,
+                                   min_anchors=args.min_anchors,
+                                   max_print=args.max_print,
+                                   json_outfile=out_json,
+                                   corpus=corpus)
+            except Exception as e:
+                print(f"[ERRORE] {prototipo}: {e}", file=sys.stderr)
+                continue
     else:
         print("Specify a prototype for the classification!")
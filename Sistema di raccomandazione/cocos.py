@@ -2,8 +2,14 @@ import math
 import os
 import json
 import argparse
+from operator import itemgetter
 from typing import Dict, List, Any
 
+try:
+    import orjson  # opzionale: scrittura JSON più veloce
+except ImportError:
+    orjson = None
+
 import lib.read_attributes as ra
 import lib.scenarios_table as st
 import lib.scenarios_blocks as sb
@@ -38,13 +44,33 @@ def sort_props_for_printing(p: Dict[str, Any]) -> List[tuple]:
     core = [(k, v) for k, v in p.items() if not k.startswith('@scenario_')]
     meta = [(k, v) for k, v in p.items() if k.startswith('@scenario_')]
 
-    core.sort(key=lambda kv: (-kv[1], kv[0]))
-    meta.sort(key=lambda kv: kv[0])
+    # due sort stabili con chiavi C (itemgetter): per nome asc, poi per valore desc
+    # → stesso ordine di key=(-valore, nome)
+    core.sort(key=itemgetter(0))
+    core.sort(key=itemgetter(1), reverse=True)
+    meta.sort(key=itemgetter(0))
     return core + meta
 
 
+# Sidecar accanto al file di input: "<offset> <size> <mtime_ns>" dell'ultimo risultato
+# scritto. Se il file non è cambiato da allora, basta troncarlo a offset.
+RESULT_OFFSET_EXT = ".cocos_offset"
+
+
 def clean_previous_results(filename: str) -> None:
     """Rimuove eventuali righe 'Result:'/'Scenario:' già presenti (per non accodare infinite volte)."""
+    # caso veloce: risultato scritto da noi e file non più toccato → truncate O(1)
+    try:
+        with open(filename + RESULT_OFFSET_EXT, 'r', encoding='utf-8') as f:
+            offset, size, mtime_ns = map(int, f.read().split())
+        stat = os.stat(filename)
+        if stat.st_size == size and stat.st_mtime_ns == mtime_ns and 0 <= offset <= size:
+            with open(filename, 'r+b') as f:
+                f.truncate(offset)
+            return
+    except (OSError, ValueError):
+        pass
+    # altrimenti rilettura completa e filtro delle righe
     with open(filename, 'r', encoding='utf-8') as f:
         lines = f.readlines()
     filtered = [ln for ln in lines if not (ln.startswith('Result:') or ln.startswith('Scenario:'))]
@@ -57,16 +83,28 @@ def write_result(filename: str, best_props: Dict[str, Any], best_raw: List[Any])
     """Scrive Result/Scenario in coda al file di input (dopo aver pulito eventuali vecchi risultati)."""
     clean_previous_results(filename)
     with open(filename, "a", encoding="utf-8") as f:
-        f.write("\nResult: " + json.dumps(best_props, ensure_ascii=False))
+        f.write("\n")
+        # da qui in poi solo righe Result/Scenario: il filtro completo lascerebbe
+        # esattamente il contenuto fino a questo punto
+        offset = f.tell()
+        f.write("Result: " + json.dumps(best_props, ensure_ascii=False))
         f.write("\nScenario: " + json.dumps(best_raw, ensure_ascii=False))
+    stat = os.stat(filename)
+    with open(filename + RESULT_OFFSET_EXT, "w", encoding="utf-8") as f:
+        f.write(f"{offset} {stat.st_size} {stat.st_mtime_ns}")
 
 
 def dump_json(out_dir: str, head: str, mod: str, scenarios: List[Dict[str, Any]]) -> None:
     """Salva anche un JSON pulito (uno per coppia), con la lista degli scenari consigliati."""
     os.makedirs(out_dir, exist_ok=True)
     out_path = os.path.join(out_dir, f"{head}_{mod}.json")
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump({"head": head, "modifier": mod, "recommended_scenarios": scenarios}, f, ensure_ascii=False, indent=2)
+    payload = {"head": head, "modifier": mod, "recommended_scenarios": scenarios}
+    if orjson is not None:
+        with open(out_path, "wb") as f:
+            f.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+    else:
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
 
 
 def run_cocos_on_file(filename: str, max_attrs: int, json_out_dir: str = None) -> None:
@@ -119,9 +157,11 @@ def main():
         run_cocos_on_file(args.filename, max_attrs, args.json_out_dir)
     else:
         # run su tutti i file nella cartella configurata
-        for file in sorted(os.listdir(cfg.COCOS_DIR)):
-            if file.lower().endswith(".txt"):
-                run_cocos_on_file(os.path.join(cfg.COCOS_DIR, file), max_attrs, args.json_out_dir)
+        # os.scandir: nome e tipo di ogni voce senza una stat per file
+        with os.scandir(cfg.COCOS_DIR) as it:
+            files = sorted(e.name for e in it if e.is_file() and e.name.lower().endswith(".txt"))
+        for file in files:
+            run_cocos_on_file(os.path.join(cfg.COCOS_DIR, file), max_attrs, args.json_out_dir)
 
 
 if __name__ == "__main__":
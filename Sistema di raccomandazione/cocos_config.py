@@ -19,3 +19,7 @@ COCOS_DIR = r"C:\Users\Utente\Desktop\DEGARI-Music\prototipi_music"
 # max number of typical properties in the combined concept
 # max 14
 MAX_ATTRS = 2
+
+# number of processes used by cocos_preprocessing to generate all the combinations
+# (1 = sequential; the pairs are independent, so any value > 1 runs them in parallel)
+WORKERS = 1
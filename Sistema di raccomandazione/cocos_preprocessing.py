@@ -3,9 +3,17 @@
 import cocos_config as cfg
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from types import MappingProxyType
+
+# number of processes used to generate all the combinations (1 = sequential)
+WORKERS = getattr(cfg, "WORKERS", 1)
 
 
 # returns a dict containing the typical properties read from the specified path
+# (read once per path and cached: the returned mapping is read-only)
+@lru_cache(maxsize=None)
 def getTypicalProperties(path_file) :    
     prop_dict = dict()
 
@@ -16,9 +24,11 @@ def getTypicalProperties(path_file) :
                 value = float(prop[1].strip())
                 prop_dict[prop[0]] = round(value, 3)
 
-    return prop_dict
+    return MappingProxyType(prop_dict)
 
-# returns a list containing the rigid properties read from the specified path
+# returns a tuple containing the rigid properties read from the specified path
+# (read once per path and cached)
+@lru_cache(maxsize=None)
 def getRigidProperties(path_file) :    
     prop_list = list()
 
@@ -27,34 +37,33 @@ def getRigidProperties(path_file) :
             for p in f.readlines():
                 prop_list.append(p.strip())
 
-    return prop_list
+    return tuple(prop_list)
 
 # write the input file for COCOS
+# (the content is assembled in memory and written with a single call)
 def write_cocos_file(head, modifier):
+    parts = [f'Title: {head}-{modifier}\n\n',
+             f'Head Concept Name: {head}\n',
+             f'Modifier Concept Name: {modifier}\n\n']
+
+    # rigid properties
+    parts.extend(f"head, {p}\n" for p in getRigidProperties(f'{cfg.RIGID_PROP_DIR}/{head}.txt'))
+    parts.append("\n")
+
+    parts.extend(f"modifier, {p}\n" for p in getRigidProperties(f'{cfg.RIGID_PROP_DIR}/{modifier}.txt'))
+    parts.append("\n")
+
+    # typical properties
+    modifier_typ = getTypicalProperties(f'{cfg.TYPICAL_PROP_DIR}/{modifier}.txt')
+    parts.extend(f'T(modifier), {p}, {v}\n' for p, v in modifier_typ.items())
+    parts.append("\n")
+
+    head_typ = getTypicalProperties(f'{cfg.TYPICAL_PROP_DIR}/{head}.txt')
+    parts.extend(f'T(head), {p}, {v}\n' for p, v in head_typ.items())
+    parts.append("\n")
+
     with open(f'{cfg.COCOS_DIR}/{head}_{modifier}.txt', "w") as f:
-        f.write(f'Title: {head}-{modifier}\n\n')
-        f.write(f'Head Concept Name: {head}\n')
-        f.write(f'Modifier Concept Name: {modifier}\n\n')
-    
-        # rigid properties
-        for p in getRigidProperties(f'{cfg.RIGID_PROP_DIR}/{head}.txt'):
-            f.write(f"head, {p}\n")
-        f.write("\n")
-        
-        for p in getRigidProperties(f'{cfg.RIGID_PROP_DIR}/{modifier}.txt'):
-            f.write(f"modifier, {p}\n")
-        f.write("\n")
-        
-        # typical properties
-        modifier_typ = getTypicalProperties(f'{cfg.TYPICAL_PROP_DIR}/{modifier}.txt')
-        for p in modifier_typ:
-            f.write(f'T(modifier), {p}, {modifier_typ[p]}\n')
-        f.write("\n")
-        
-        head_typ = getTypicalProperties(f'{cfg.TYPICAL_PROP_DIR}/{head}.txt')
-        for p in head_typ:
-            f.write(f'T(head), {p}, {head_typ[p]}\n')
-        f.write("\n")
+        f.write("".join(parts))
 
 
 
@@ -72,7 +81,12 @@ if __name__ == '__main__' :
         print("Running all possible combinations...")
         print("To run a specific combination: python3 cocos_preprocessing.py <head_concept> <modifier_concept>\n")
         file_list = os.listdir(cfg.TYPICAL_PROP_DIR)
-        for f1 in file_list:
-            for f2 in file_list:
-                if f1 != f2:
-                    write_cocos_file(f1.split(".")[0], f2.split(".")[0])
\ No newline at end of file
+        pairs = [(f1.split(".")[0], f2.split(".")[0]) for f1 in file_list for f2 in file_list if f1 != f2]
+        if WORKERS > 1 and pairs:
+            # the pairs are independent and write disjoint files: fan-out over processes
+            # (each worker reads every property file once through its own cache)
+            with ProcessPoolExecutor(max_workers=WORKERS) as ex:
+                list(ex.map(write_cocos_file, *zip(*pairs), chunksize=16))
+        else:
+            for head, modifier in pairs:
+                write_cocos_file(head, modifier)
\ No newline at end of file
@@ -5,11 +5,11 @@ class ReadAttributes:
         
         # save file lines on a list
         with open(path) as f:
-            self.input_lines = f.readlines()
+            self.input_lines = f.read().splitlines()
 
-        # remove comments and void lines
-        self.input_lines = [x.strip() for x in self.input_lines 
-                            if x.strip() != '' and x.strip()[0] != '#']
+        # remove comments and void lines (each line stripped once)
+        stripped = (x.strip() for x in self.input_lines)
+        self.input_lines = [x for x in stripped if x and x[0] != '#']
         
         # save title, head name and modifier name
         self.title = self.input_lines[0].split(':')[1].strip()
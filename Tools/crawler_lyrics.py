@@ -18,10 +18,11 @@ Script UNICO che:
 - Output:
     * per-song (default): 1 JSON per canzone, nome: <prototipo>__extended.json
     * single-json: un unico file con una lista di record
+    * jsonl: un unico file JSON Lines (un record per riga), scritto man mano
 - Opzioni utili:
     * --clean     : svuota la cartella output prima di scrivere
     * --fetch-missing-lyrics : tenta recupero testi mancanti da Genius
-    * --out-mode per-song|single-json
+    * --out-mode per-song|single-json|jsonl
 
 Dipendenze opzionali (solo se usi --fetch-missing-lyrics):
     pip install lyricsgenius python-slugify unidecode
@@ -34,14 +35,80 @@ import json
 import os
 import random
 import re
+import sqlite3
 import sys
+import threading
 import time
 import logging
 import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Tuple, Any, Optional
 
+try:
+    import orjson  # opzionale: scrittura dei JSON di output più veloce
+except ImportError:
+    orjson = None
+
+# =======================
+# Scrittura JSON (orjson se presente, altrimenti json)
+# =======================
+def write_json(path: Path, obj: Any) -> None:
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    else:
+        path.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+
+def json_line(obj: Any) -> bytes:
+    """Una riga JSON Lines (compatta, UTF-8, terminata da newline)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
+
+# Scritture per-song su thread: la scrittura su disco (fuori dal GIL) si sovrappone
+# alla generazione del piano successivo; al massimo WRITE_PENDING record in attesa
+WRITE_WORKERS = 8
+WRITE_PENDING = 64
+
+class BackgroundWriter:
+    """
+    write_json eseguita da un pool di thread, con un limite ai record in sospeso.
+    Un errore di scrittura viene rilanciato alla submit successiva (o da close()),
+    come farebbe la scrittura diretta; le scritture concluse non restano in memoria.
+    """
+    def __init__(self, workers: int = WRITE_WORKERS, pending: int = WRITE_PENDING):
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(pending)
+        self._error: Optional[BaseException] = None
+
+    def _done(self, fut) -> None:
+        exc = fut.exception()
+        if exc is not None and self._error is None:
+            self._error = exc
+        self._slots.release()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            err, self._error = self._error, None
+            raise err
+
+    def submit(self, path: Path, obj: Any) -> None:
+        self._raise_error()
+        self._slots.acquire()
+        self._pool.submit(write_json, path, obj).add_done_callback(self._done)
+
+    def shutdown(self) -> None:
+        """Attende le scritture in corso senza rilanciare errori (uscita per eccezione)."""
+        self._pool.shutdown(wait=True)
+
+    def close(self) -> None:
+        """Attende tutte le scritture e rilancia il primo errore non ancora segnalato."""
+        self.shutdown()
+        self._raise_error()
+
 # =======================
 # RNG deterministico
 # =======================
@@ -55,13 +122,17 @@ GENRES = {"country", "metal", "pop", "rap", "reggae", "rnb", "rock", "trap"}
 # =======================
 # Utility base di normalizzazione
 # =======================
+# "_", "-", punteggiatura e spazi diventano un solo spazio (un unico passaggio)
+NORM_SEP_RE = re.compile(r"[\W_]+")
+PROTO_NAME_RE = re.compile(r"^(?P<genre>[a-z]+)_(?P<artist>[^_]+)_(?P<title>[^_]+)_(?P<year>\d{4})", re.IGNORECASE)
+
 def norm_txt(s: str) -> str:
     s = s or ""
-    s = s.lower()
-    s = re.sub(r"[_\-]+", " ", s)
-    s = re.sub(r"[^\w\s]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    return NORM_SEP_RE.sub(" ", s.lower()).strip()
+
+def genius_key(meta: Dict[str, Any]) -> Tuple[str, str]:
+    """Chiave (title_norm, artist_norm) dell'indice genius per un prototipo."""
+    return norm_txt(meta.get("title", "") or ""), norm_txt(meta.get("artist", "") or "")
 
 def parse_prototype_filename(name: str) -> Dict[str, Any]:
     """
@@ -69,7 +140,7 @@ def parse_prototype_filename(name: str) -> Dict[str, Any]:
     Restituisce dict con chiavi: genre/artist/title/year (tutte stringhe o None)
     """
     base = Path(name).stem
-    m = re.match(r"^(?P<genre>[a-z]+)_(?P<artist>[^_]+)_(?P<title>[^_]+)_(?P<year>\d{4})", base, re.IGNORECASE)
+    m = PROTO_NAME_RE.match(base)
     out = {"genre": None, "artist": None, "title": None, "year": None}
     if m:
         out.update({k: m.group(k) for k in ("genre", "artist", "title", "year")})
@@ -113,6 +184,9 @@ def load_genius(path: Path) -> Tuple[List[dict], Dict[Tuple[str, str], dict]]:
 # =======================
 # Lettura KV dai profili typical/rigid
 # =======================
+KV_LINE_RE = re.compile(r"^([A-Za-z0-9_\-\.]+)\s*[:=\s]\s*([0-9]+[\,\.]?[0-9]*)$")
+KV_TOKEN_RE = re.compile(r"[A-Za-z0-9_\-\.]+")
+
 def parse_kv_text(text: str) -> Dict[str, float]:
     """
     Supporta:
@@ -129,7 +203,7 @@ def parse_kv_text(text: str) -> Dict[str, float]:
         if not line or line.startswith("#"):
             continue
         line = line.replace("\t", " ")
-        m = re.match(r"^([A-Za-z0-9_\-\.]+)\s*[:=\s]\s*([0-9]+[\,\.]?[0-9]*)$", line)
+        m = KV_LINE_RE.match(line)
         if m:
             key = m.group(1).lower()
             val = m.group(2).replace(",", ".")
@@ -138,7 +212,7 @@ def parse_kv_text(text: str) -> Dict[str, float]:
             except ValueError:
                 pass
         else:
-            toks = re.findall(r"[A-Za-z0-9_\-\.]+", line)
+            toks = KV_TOKEN_RE.findall(line)
             for t in toks:
                 out[t.lower()] = 1.0
     return out
@@ -147,9 +221,10 @@ def load_profile_dir(d: Path) -> Dict[str, Dict[str, float]]:
     profiles = {}
     if not d or not d.exists():
         return profiles
-    for f in d.iterdir():
-        if not f.is_file():
-            continue
+    # os.scandir: il tipo di ogni voce arriva con la lista (niente stat per file)
+    with os.scandir(d) as it:
+        entries = [Path(e.path) for e in it if e.is_file()]
+    for f in entries:
         g = f.stem.lower()
         if g not in GENRES:
             continue
@@ -211,24 +286,29 @@ def choose_features(typical: Dict[str, float], rigid: Dict[str, float]) -> Tuple
 # =======================
 # Default range BPM per genere
 # =======================
+TEMPO_RANGES = {
+    "pop": (90, 120),
+    "rap": (80, 100),
+    "trap": (130, 160),
+    "rock": (100, 150),
+    "metal": (120, 200),
+    "rnb": (70, 105),
+    "reggae": (70, 90),
+    "country": (70, 110),
+}
+
 def default_tempo_range(genre: str) -> Tuple[int, int]:
-    g = genre.lower()
-    return {
-        "pop": (90, 120),
-        "rap": (80, 100),
-        "trap": (130, 160),
-        "rock": (100, 150),
-        "metal": (120, 200),
-        "rnb": (70, 105),
-        "reggae": (70, 90),
-        "country": (70, 110),
-    }.get(g, (90, 120))
+    return TEMPO_RANGES.get(genre.lower(), (90, 120))
 
 # =======================
 # Strumentazione suggerita
 # =======================
 def instrumentation_from_features(genre: str, feats: List[str], enforced: List[str]) -> List[str]:
-    g = genre.lower()
+    # poche combinazioni distinte (genere + feature scelte): calcolate una volta, lista nuova per record
+    return list(_instrumentation(genre.lower(), tuple(feats), tuple(enforced)))
+
+@lru_cache(maxsize=4096)
+def _instrumentation(g: str, feats: Tuple[str, ...], enforced: Tuple[str, ...]) -> Tuple[str, ...]:
     inst = []
     if g in {"rap", "trap"}:
         if any(f in feats for f in ["trap_808", "hi_hat_rolls", "808"]):
@@ -251,15 +331,19 @@ def instrumentation_from_features(genre: str, feats: List[str], enforced: List[s
         inst += ["skank guitar on offbeat", "deep bass", "rimshot/snare on 3", "organ bubble"]
     elif g == "country":
         inst += ["acoustic guitar", "pedal steel", "fiddle", "light drums"]
-    return sorted(set(inst))
+    return tuple(sorted(set(inst)))
 
 # =======================
 # Struttura brano (dipende da genere + tag Genius opzionali)
 # =======================
 def make_structure(genre: str, genius_tags: List[str]) -> List[Dict[str, Any]]:
-    g = genre.lower()
     tags = set((genius_tags or []))
     high_rep = any(t in tags for t in ["high_repetition", "hook_repetition", "catchy_chorus"])
+    # schema calcolato una volta per (genere, high_rep); dict nuovi per ogni record
+    return [dict(sec) for sec in _structure(genre.lower(), high_rep)]
+
+@lru_cache(maxsize=None)
+def _structure(g: str, high_rep: bool) -> Tuple[Dict[str, Any], ...]:
     if g in {"rap", "trap"}:
         base = [
             {"section": "Intro", "bars": 4},
@@ -270,7 +354,7 @@ def make_structure(genre: str, genius_tags: List[str]) -> List[Dict[str, Any]]:
         ]
         if high_rep:
             base.append({"section": "Hook (outro)", "bars": 8})
-        return base
+        return tuple(base)
     if g in {"pop", "rnb"}:
         base = [
             {"section": "Intro", "bars": 4},
@@ -285,7 +369,7 @@ def make_structure(genre: str, genius_tags: List[str]) -> List[Dict[str, Any]]:
             base += [{"section": "Bridge", "bars": 8}, {"section": "Double Chorus", "bars": 16}]
         else:
             base += [{"section": "Bridge", "bars": 8}, {"section": "Chorus", "bars": 8}]
-        return base
+        return tuple(base)
     if g in {"rock", "metal", "country", "reggae"}:
         base = [
             {"section": "Intro", "bars": 4},
@@ -298,23 +382,79 @@ def make_structure(genre: str, genius_tags: List[str]) -> List[Dict[str, Any]]:
         ]
         if high_rep:
             base.append({"section": "Chorus (outro)", "bars": 8})
-        return base
-    return [{"section": "Intro", "bars": 4}, {"section": "Verse", "bars": 16}, {"section": "Chorus", "bars": 8}]
+        return tuple(base)
+    return ({"section": "Intro", "bars": 4}, {"section": "Verse", "bars": 16}, {"section": "Chorus", "bars": 8})
 
 # =======================
 # Focus testuale
 # =======================
+FOCUS_RE = re.compile(r"(flow|rhyme|punchline|story|wordplay|melody|hook|attitude|harmony)")
+
 def lyrical_focus_from_typical(typical: Dict[str, float]) -> List[str]:
-    keys = [k for k in typical.keys() if re.search(r"(flow|rhyme|punchline|story|wordplay|melody|hook|attitude|harmony)", k)]
+    keys = [k for k in typical.keys() if FOCUS_RE.search(k)]
     keys = sorted(keys, key=lambda k: typical.get(k, 0.0), reverse=True)
     return keys[:5]
 
 # =======================
 # Recupero lyrics via Genius (opzionale)
 # =======================
+# Cache dei testi: un unico file SQLite (cache_dir/lyrics.sqlite) invece di un file
+# per canzone. Connessione aperta una volta per cartella e condivisa fra i thread
+# di prefetch_missing_lyrics (accessi serializzati dal lock).
+_LYRICS_DB: Dict[str, sqlite3.Connection] = {}
+_LYRICS_DB_LOCK = threading.Lock()
+_INHERITED_DB: List[sqlite3.Connection] = []  # connessioni ereditate dal padre (mai usate)
+
+def _lyrics_db(cache_dir: Path) -> sqlite3.Connection:
+    with _LYRICS_DB_LOCK:
+        key = str(cache_dir)
+        if key not in _LYRICS_DB:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(cache_dir / "lyrics.sqlite"), check_same_thread=False)
+            conn.execute("CREATE TABLE IF NOT EXISTS lyrics (key TEXT PRIMARY KEY, text TEXT NOT NULL)")
+            conn.commit()
+            _LYRICS_DB[key] = conn
+        return _LYRICS_DB[key]
+
+def _cache_get(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    with _LYRICS_DB_LOCK:
+        row = conn.execute("SELECT text FROM lyrics WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _cache_put(conn: sqlite3.Connection, key: str, text: str) -> None:
+    with _LYRICS_DB_LOCK:
+        conn.execute("INSERT OR REPLACE INTO lyrics (key, text) VALUES (?, ?)", (key, text))
+        conn.commit()
+
+# Limite di richieste verso Genius condiviso da tutti i thread di download:
+# al più GENIUS_MAX_RPS richieste al secondo; un 429 (o timeout) sospende tutti
+# i thread per il tempo di backoff, non solo quello che l'ha ricevuto.
+GENIUS_MAX_RPS = 4.0
+
+class RateLimiter:
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+    def backoff(self, seconds: float) -> None:
+        with self.lock:
+            self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+_GENIUS_LIMITER = RateLimiter(GENIUS_MAX_RPS)
+
 def get_lyrics_via_genius(song_id: Optional[int], url: Optional[str] = None, cache_dir: Optional[Path] = None) -> Optional[str]:
     """
-    Tenta di prendere i testi via lyricsgenius con backoff leggero.
+    Tenta di prendere i testi via lyricsgenius con backoff esponenziale
+    (rate limit condiviso: _GENIUS_LIMITER).
     Richiede GENIUS_TOKEN nell'ambiente e la libreria 'lyricsgenius'.
     """
     token = os.getenv("GENIUS_TOKEN")
@@ -326,6 +466,32 @@ def get_lyrics_via_genius(song_id: Optional[int], url: Optional[str] = None, cac
     except Exception:
         return None
 
+    # niente da cercare: nessun accesso a cache/database
+    if not song_id and not url:
+        return None
+
+    cache_dir = cache_dir or (Path(__file__).resolve().parent / "cache_lyrics")
+    db = _lyrics_db(cache_dir)
+    ckey = str(song_id) if song_id else f"url_{slugify_safe(url or '')}"
+
+    # cache first: testo grezzo nel database (una query, nessun file per canzone)
+    text = _cache_get(db, ckey)
+    if text is not None:
+        return text
+    # vecchi formati un file per canzone (.txt grezzo o {"lyrics": ...} in .json):
+    # letti una volta e spostati nel database
+    for ext in (".txt", ".json"):
+        legacy = cache_dir / f"{ckey}{ext}"
+        if legacy.exists():
+            try:
+                raw = legacy.read_text("utf-8")
+                text = raw if ext == ".txt" else json.loads(raw).get("lyrics")
+                if text:
+                    _cache_put(db, ckey, text)
+                    return text
+            except Exception:
+                pass
+
     genius = Genius(
         token,
         skip_non_songs=True,
@@ -337,22 +503,9 @@ def get_lyrics_via_genius(song_id: Optional[int], url: Optional[str] = None, cac
         verbose=False,
     )
 
-    cache_dir = cache_dir or (Path(__file__).resolve().parent / "cache_lyrics")
-    cache_dir.mkdir(parents=True, exist_ok=True)
-
-    def cp(song_id_: Optional[int]) -> Path:
-        return cache_dir / f"{song_id_}.json" if song_id_ else cache_dir / f"url_{slugify_safe(url or '')}.json"
-
-    # cache first
-    cpath = cp(song_id)
-    if cpath.exists():
-        try:
-            return json.loads(cpath.read_text("utf-8")).get("lyrics")
-        except Exception:
-            pass
-
     delay = 0.6
     for attempt in range(5):
+        _GENIUS_LIMITER.wait()
         try:
             text = None
             if song_id:
@@ -361,28 +514,49 @@ def get_lyrics_via_genius(song_id: Optional[int], url: Optional[str] = None, cac
                 text = genius.lyrics(url=url)
             text = clean_lyrics(text)
             if text:
-                cpath.write_text(json.dumps({"lyrics": text}, ensure_ascii=False), encoding="utf-8")
+                _cache_put(db, ckey, text)
                 return text
             return None
         except Exception as e:
             msg = str(e).lower()
             if "429" in msg or "rate limit" in msg or "timed out" in msg or "timeout" in msg:
                 sleep_for = delay * (2 ** attempt) + random.uniform(0, 0.6)
-                time.sleep(sleep_for)
+                _GENIUS_LIMITER.backoff(sleep_for)
                 continue
             time.sleep(0.5 + 0.2 * attempt)
     return None
 
+# Download concorrenti dei testi mancanti: lavoro I/O-bound (attesa di rete),
+# i thread sovrappongono le attese; ogni richiesta mantiene il proprio backoff
+FETCH_WORKERS = 8
+
+def prefetch_missing_lyrics(keys: List[Tuple[Optional[int], str]], workers: int = FETCH_WORKERS) -> Dict[Tuple[Optional[int], str], Optional[str]]:
+    """
+    Recupera in parallelo i testi per le chiavi (genius_id, url) indicate.
+    Restituisce {(genius_id, url): testo o None}; la cache resta quella di
+    get_lyrics_via_genius (i testi già in cache non fanno richieste).
+    """
+    keys = list(dict.fromkeys(k for k in keys if k[0] or k[1]))
+    if not keys:
+        return {}
+    with ThreadPoolExecutor(max(1, workers)) as ex:
+        texts = ex.map(lambda k: get_lyrics_via_genius(k[0], k[1]), keys)
+        return dict(zip(keys, texts))
+
 # Helpers per cleaning testo (come nel crawler)
-BRACKET_RE = re.compile(r"\[.*?\]")
-JUNK_LINES_RE = re.compile(r"(?im)^\s*(you might also like|embed|translation[s]?:?|more on genius).*$")
+# intestazioni [..] e righe "spazzatura" di Genius rimosse in un solo passaggio
+# (le [..] stanno su una riga e non possono sovrapporsi a una riga spazzatura)
+CLEAN_RE = re.compile(
+    r"\[.*?\]|^\s*(?:you might also like|embed|translation[s]?:?|more on genius).*$",
+    re.IGNORECASE | re.MULTILINE,
+)
 MULTISPACE_RE = re.compile(r"\s+")
+SLUG_RE = re.compile(r"[^\w]+")
 
 def clean_lyrics(lyrics: Optional[str]) -> str:
     if not lyrics:
         return ""
-    t = JUNK_LINES_RE.sub(" ", lyrics)
-    t = BRACKET_RE.sub(" ", t)
+    t = CLEAN_RE.sub(" ", lyrics)
     # niente unidecode di default, preserviamo eventuali accenti
     t = MULTISPACE_RE.sub(" ", t).strip()
     return t
@@ -392,7 +566,7 @@ def slugify_safe(s: str) -> str:
         from slugify import slugify
         return slugify(s)
     except Exception:
-        return re.sub(r"[^\w]+", "-", s.strip().lower()).strip("-")
+        return SLUG_RE.sub("-", s.strip().lower()).strip("-")
 
 # =======================
 # Estensione di UNA canzone
@@ -404,6 +578,7 @@ def extend_one(
     rigid_g: Dict[str, float],
     genius_idx: Dict[Tuple[str, str], dict],
     fetch_missing_lyrics: bool = False,
+    fetched_lyrics: Optional[Dict[Tuple[Optional[int], str], Optional[str]]] = None,
 ) -> Dict[str, Any]:
     """
     Crea il piano esteso e prova ad arricchire con metadati/lyrics da Genius.
@@ -411,10 +586,10 @@ def extend_one(
     genre = (meta.get("genre") or "").lower()
     artist_raw = meta.get("artist", "") or ""
     title_raw = meta.get("title", "") or ""
-    artist = norm_txt(artist_raw)
-    title = norm_txt(title_raw)
+    # chiave normalizzata una volta sola in main (meta["genius_key"]), calcolata qui solo se manca
+    key = meta.get("genius_key") or genius_key(meta)
 
-    genius_rec = genius_idx.get((title, artist), {}) if genius_idx else {}
+    genius_rec = genius_idx.get(key, {}) if genius_idx else {}
     genius_tags = genius_rec.get("tags", []) if isinstance(genius_rec.get("tags"), list) else []
     genius_id = genius_rec.get("genius_id") or genius_rec.get("id")
     genius_url = genius_rec.get("source_url") or genius_rec.get("url") or ""
@@ -432,7 +607,11 @@ def extend_one(
     # testi integrali: preferisci quelli già presenti nel JSON "genius".
     lyrics_full = genius_rec.get("lyrics") or ""
     if not lyrics_full and fetch_missing_lyrics:
-        lyrics_full = get_lyrics_via_genius(genius_id, genius_url)
+        fetch_key = (genius_id, genius_url)
+        if fetched_lyrics is not None and fetch_key in fetched_lyrics:
+            lyrics_full = fetched_lyrics[fetch_key]
+        else:
+            lyrics_full = get_lyrics_via_genius(genius_id, genius_url)
 
     return {
         "source_file": meta.get("source_file"),
@@ -463,6 +642,69 @@ def extend_one(
         "lyrics": lyrics_full or "",
     }
 
+# =======================
+# Elaborazione di un prototipo (anche in un processo del pool)
+# =======================
+# Contesto condiviso (profili, indice genius, testi scaricati, opzioni di output):
+# nei processi del pool arriva una volta sola tramite l'initializer, non per task.
+_CTX: Dict[str, Any] = {}
+
+def _init_context(ctx: Dict[str, Any]) -> None:
+    _CTX.clear()
+    _CTX.update(ctx)
+
+def _init_worker(ctx: Dict[str, Any]) -> None:
+    """Initializer dei processi del pool: contesto condiviso + cache dei testi propria."""
+    global _LYRICS_DB_LOCK
+    _init_context(ctx)
+    # Con fork i processi del pool ereditano le connessioni SQLite (e il lock) del padre,
+    # che non vanno usate in un altro processo: ogni processo apre le proprie.
+    # Le connessioni ereditate non vengono chiuse qui (restano del padre), solo dimenticate.
+    _INHERITED_DB.extend(_LYRICS_DB.values())
+    _LYRICS_DB.clear()
+    _LYRICS_DB_LOCK = threading.Lock()
+
+def rnd_draws(typical_g: Dict[str, float]) -> int:
+    """
+    Numeri estratti da RND per un piano: uno per ogni typical con peso < 0.9
+    (choose_features) più il tempo. Serve a ricostruire lo stato di RND di ogni
+    prototipo quando i piani sono generati in parallelo.
+    """
+    return 1 + sum(1 for w in (typical_g or {}).values() if not w >= 0.9)
+
+def process_prototype(f: Path, meta: Dict[str, Any], rnd_state: Optional[tuple] = None) -> List[Dict[str, Any]]:
+    """
+    Genera le varianti di un prototipo; in per-song le scrive subito su disco,
+    in single-json/jsonl le restituisce. rnd_state: stato di RND da cui partire (pool).
+    """
+    if rnd_state is not None:
+        RND.setstate(rnd_state)
+    genre = meta["genre"].lower()
+    meta["source_file"] = str(f)
+    try:
+        seed = f.read_text(encoding="utf-8", errors="ignore")
+    except Exception:
+        seed = ""
+    typ_g = _CTX["typical"].get(genre, {})
+    rig_g = _CTX["rigid"].get(genre, {})
+    n_per_song = _CTX["n_per_song"]
+
+    stem = f.stem
+    records = []
+    # una sola variante (default). Se >1, rispettalo comunque.
+    for i in range(max(1, n_per_song)):
+        rec = extend_one(seed, meta, typ_g, rig_g, _CTX["genius_idx"],
+                         fetch_missing_lyrics=_CTX["fetch_missing_lyrics"], fetched_lyrics=_CTX["fetched_lyrics"])
+        if _CTX["out_mode"] == "per-song":
+            out_name = f"{stem}__extended.json" if n_per_song == 1 else f"{stem}__extended_{i+1}.json"
+            if _CTX.get("writer") is not None:
+                _CTX["writer"].submit(_CTX["outp"] / out_name, rec)
+            else:
+                write_json(_CTX["outp"] / out_name, rec)
+        else:
+            records.append(rec)
+    return records
+
 # =======================
 # Core MAIN
 # =======================
@@ -472,11 +714,14 @@ def main():
     ap.add_argument("--typical", required=True, help="Cartella profili typical per genere")
     ap.add_argument("--rigid", required=True, help="Cartella profili rigid per genere")
     ap.add_argument("--genius", required=False, help="Path a descr_music_GENIUS.json (o simile) con lyrics integrali")
-    ap.add_argument("--out", required=True, help="Output: cartella (per-song) oppure file .json (single-json)")
-    ap.add_argument("--out-mode", choices=["per-song", "single-json"], default="per-song", help="Formato output")
+    ap.add_argument("--out", required=True, help="Output: cartella (per-song) oppure file .json (single-json) / .jsonl (jsonl)")
+    ap.add_argument("--out-mode", choices=["per-song", "single-json", "jsonl"], default="per-song",
+                    help="Formato output (jsonl: un record per riga, scritto man mano senza tenere tutto in memoria)")
     ap.add_argument("--n_per_song", type=int, default=1, help="Numero varianti per canzone (default 1)")
     ap.add_argument("--clean", action="store_true", help="Svuota la cartella di output prima di scrivere (solo per-song)")
     ap.add_argument("--fetch-missing-lyrics", action="store_true", help="Recupera testi mancanti da Genius se GENIUS_TOKEN presente")
+    ap.add_argument("--fetch-workers", type=int, default=FETCH_WORKERS, help=f"Download concorrenti per --fetch-missing-lyrics (default {FETCH_WORKERS})")
+    ap.add_argument("--workers", type=int, default=1, help="Processi per generare i piani (default 1 = sequenziale); output identico")
     args = ap.parse_args()
 
     inp = Path(args.input)
@@ -505,7 +750,7 @@ def main():
                         pass
         outp.mkdir(parents=True, exist_ok=True)
     else:
-        # single-json: assicura che la cartella esista
+        # single-json/jsonl: assicura che la cartella esista
         outp.parent.mkdir(parents=True, exist_ok=True)
 
     # carica profili
@@ -524,39 +769,85 @@ def main():
     # logging gentile
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
-    # iter prototipi
-    for f in sorted(inp.glob("*.txt")):
+    # prototipi validi (genere riconosciuto)
+    protos = []
+    # una sola scansione della cartella (os.scandir: tipo di file senza stat aggiuntive)
+    with os.scandir(inp) as it:
+        txt_files = sorted(inp / e.name for e in it if e.name.endswith(".txt") and e.is_file())
+    for f in txt_files:
         meta = parse_prototype_filename(f.name)
         if not meta.get("genre"):
             continue
-        genre = meta["genre"].lower()
-        if genre not in GENRES:
+        if meta["genre"].lower() not in GENRES:
             continue
-        meta["source_file"] = str(f)
-        try:
-            seed = f.read_text(encoding="utf-8", errors="ignore")
-        except Exception:
-            seed = ""
-        typ_g = typical.get(genre, {})
-        rig_g = rigid.get(genre, {})
-
-        # una sola variante (default). Se >1, rispettalo comunque.
-        for i in range(max(1, args.n_per_song)):
-            rec = extend_one(seed, meta, typ_g, rig_g, genius_idx, fetch_missing_lyrics=args.fetch_missing_lyrics)
-            if args.out_mode == "per-song":
-                out_name = f"{Path(f).stem}__extended.json" if args.n_per_song == 1 else f"{Path(f).stem}__extended_{i+1}.json"
-                (outp / out_name).write_text(json.dumps(rec, ensure_ascii=False, indent=2), encoding="utf-8")
+        meta["genius_key"] = genius_key(meta)
+        protos.append((f, meta))
+
+    # testi mancanti: scaricati tutti insieme, in parallelo, prima di costruire i piani
+    fetched_lyrics = None
+    if args.fetch_missing_lyrics:
+        missing = []
+        for f, meta in protos:
+            rec = genius_idx.get(meta["genius_key"], {}) if genius_idx else {}
+            if not rec.get("lyrics"):
+                missing.append((rec.get("genius_id") or rec.get("id"), rec.get("source_url") or rec.get("url") or ""))
+        fetched_lyrics = prefetch_missing_lyrics(missing, args.fetch_workers)
+
+    # iter prototipi
+    ctx = {
+        "typical": typical, "rigid": rigid, "genius_idx": genius_idx,
+        "fetch_missing_lyrics": args.fetch_missing_lyrics, "fetched_lyrics": fetched_lyrics,
+        "out_mode": args.out_mode, "outp": outp, "n_per_song": args.n_per_song,
+    }
+    use_pool = args.workers > 1 and len(protos) > 1
+    if use_pool:
+        # Ogni prototipo parte dallo stato di RND che avrebbe nel ciclo sequenziale
+        # (il numero di estrazioni per piano è noto a priori): piani identici.
+        states = []
+        for f, meta in protos:
+            states.append(RND.getstate())
+            for _ in range(max(1, args.n_per_song) * rnd_draws(typical.get(meta["genre"].lower(), {}))):
+                RND.random()
+
+    # I piani sono consumati man mano che arrivano (in ordine): in jsonl ogni record
+    # va subito su file, senza accumulare la lista completa in memoria.
+    n_records = 0
+    writer = None
+    with ExitStack() as stack:
+        if use_pool:
+            ex = stack.enter_context(ProcessPoolExecutor(max_workers=min(args.workers, len(protos)),
+                                                         initializer=_init_worker, initargs=(ctx,)))
+            results = ex.map(process_prototype, *zip(*protos), states, chunksize=8)
+        else:
+            # sequenziale: in per-song i file sono scritti in background
+            writer = BackgroundWriter() if args.out_mode == "per-song" else None
+            if writer is not None:
+                # in caso di eccezione attende solo le scritture, senza coprire l'errore originale
+                stack.callback(writer.shutdown)
+            _init_context(dict(ctx, writer=writer))
+            results = (process_prototype(f, meta) for f, meta in protos)
+        jsonl = stack.enter_context(open(outp, "wb")) if args.out_mode == "jsonl" else None
+
+        for (f, _), records in zip(protos, results):
+            if jsonl is not None:
+                for rec in records:
+                    jsonl.write(json_line(rec))
             else:
-                all_records.append(rec)
-        log_lines.append(f"[OK] {f.name} -> {max(1, args.n_per_song)} piani")
+                all_records.extend(records)
+            n_records += len(records)
+            log_lines.append(f"[OK] {f.name} -> {max(1, args.n_per_song)} piani")
+        if writer is not None:
+            writer.close()  # ultime scritture concluse (e senza errori) prima del riepilogo
 
     # salvataggi finali
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     if args.out_mode == "per-song":
         (outp / "_log.txt").write_text(f"Run {ts}\n" + "\n".join(log_lines), encoding="utf-8")
         print(f"Creati piani in: {outp}")
+    elif args.out_mode == "jsonl":
+        print(f"Creato file JSONL: {outp} (brani: {n_records})")
     else:
-        outp.write_text(json.dumps(all_records, ensure_ascii=False, indent=2), encoding="utf-8")
+        write_json(outp, all_records)
         print(f"Creato file unico: {outp} (brani: {len(all_records)})")
 
 if __name__ == "__main__":
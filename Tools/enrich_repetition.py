@@ -12,30 +12,48 @@
 # - Riconosce (best-effort) etichette tra parentesi quadre tipo [Chorus], [Hook]
 #   e le usa come "boost" per i flag (configurabile via --no-section-boost)
 
-import argparse, json, re, os
-from collections import Counter
-from typing import List, Dict, Any, Tuple
+import argparse, hashlib, json, re, os, sqlite3
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from itertools import islice
+from typing import List, Dict, Any, Tuple, Iterable, Iterator, Optional
+
+try:
+    import ijson  # opzionale: lettura in streaming, un item alla volta
+except ImportError:
+    ijson = None
+
+try:
+    import orjson  # opzionale: serializzazione più veloce dell'output
+except ImportError:
+    orjson = None
 
 # ----------------------------
 # Utility per tokenizzazione
 # ----------------------------
 
-def ngrams(tokens: List[str], n: int) -> List[str]:
-    """Costruisce lista di n-gram come stringhe unite da '_'."""
-    if n <= 1:
-        return tokens[:]
-    return ["_".join(tokens[i:i+n]) for i in range(len(tokens) - n + 1)]
+class _KeepTable(dict):
+    """
+    Tabella per str.translate: a-z, 0-9 e apostrofo restano, ogni altro carattere
+    (anche non ASCII) diventa spazio. Le voci mancanti sono create al primo uso.
+    """
+    def __missing__(self, code: int) -> str:
+        self[code] = " "
+        return " "
+
+_KEEP_TABLE = _KeepTable({ord(c): c for c in "abcdefghijklmnopqrstuvwxyz0123456789'"})
 
 def normalize_text(text: str) -> List[str]:
     """
     Normalizza il testo:
     - minuscole
     - mantiene lettere a-z, cifre 0-9 e apostrofo
-    - sostituisce il resto con spazio
+    - sostituisce il resto con spazio (str.translate: un solo passaggio in C)
     - rimuove token di lunghezza 1 (tranne cifre/apostrofi già filtrati)
     """
-    t = (text or "").lower()
-    t = re.sub(r"[^a-z0-9\s']", " ", t)
+    t = (text or "").lower().translate(_KEEP_TABLE)
     toks = [w for w in t.split() if len(w) > 1]
     return toks
 
@@ -46,11 +64,11 @@ def extract_section_labels(raw_text: str) -> List[str]:
     Estrae etichette di sezione tipo [Chorus], [Hook], [Verse], ecc.
     Restituisce lista normalizzata (minuscole, spazi normalizzati).
     """
-    labels = []
-    for m in SECTION_TAG_RE.finditer(raw_text or ""):
-        label = re.sub(r"\s+", " ", m.group(1).strip().lower())
-        labels.append(label)
-    return labels
+    # senza "[" (caso comune) nessuna etichetta: niente scansione con la regex.
+    # Dopo strip() il gruppo non contiene spazi interni: basta lower()
+    if not raw_text or "[" not in raw_text:
+        return []
+    return [m.group(1).strip().lower() for m in SECTION_TAG_RE.finditer(raw_text)]
 
 # ----------------------------
 # Core scoring
@@ -95,12 +113,11 @@ def repetition_scores(
     uniq = len(set(toks))
     rep_ratio = max(0.0, 1.0 - (uniq / total))
 
-    # 3) n-gram frequenti
-    big = ngrams(toks, 2)
-    tri = ngrams(toks, 3)
+    # 3) n-gram frequenti: conteggio su tuple (nessuna stringa intermedia per n-gram),
+    #    solo i top-5 vengono uniti con '_' (i token non contengono '_': stesse chiavi)
     most_uni = Counter(toks).most_common(n_top_terms)
-    most_big = Counter(big).most_common(5)
-    most_tri = Counter(tri).most_common(5)
+    most_big = [("_".join(k), v) for k, v in Counter(zip(toks, toks[1:])).most_common(5)]
+    most_tri = [("_".join(k), v) for k, v in Counter(zip(toks, toks[1:], toks[2:])).most_common(5)]
 
     # 4) euristiche chorus/hook su n-gram (percentuale sul totale token)
     #    Soglie “morbide”, funzionano bene su testi lunghi
@@ -132,51 +149,221 @@ def repetition_scores(
         "section_labels": labels  # utile per debug/analisi
     }
 
+def item_lyrics(item: Dict[str, Any]) -> str:
+    # Lyrics: usa "lyrics", fallback a "text" se non presente
+    return item.get("lyrics") or item.get("text") or ""
+
+# ----------------------------
+# Cache dei punteggi
+# ----------------------------
+
+def score_key(text: str, section_boost: bool) -> str:
+    """Chiave di cache: hash del testo + opzione section_boost (cambia i flag)."""
+    h = hashlib.blake2b(text.encode("utf-8"), digest_size=16)
+    h.update(b"\x01" if section_boost else b"\x00")
+    return h.hexdigest()
+
+def dump_scores(scores: Dict[str, Any]) -> str:
+    """Punteggi in JSON compatto per la cache (orjson se presente: stesso formato leggibile)."""
+    if orjson is not None:
+        return orjson.dumps(scores).decode("utf-8")
+    return json.dumps(scores, ensure_ascii=False)
+
+class ScoreCache:
+    """
+    Cache dei punteggi a due livelli, per chiave score_key:
+    - in memoria: LRU degli ultimi memo_size risultati (testi duplicati nella stessa esecuzione)
+    - su disco (opzionale): tabella SQLite riusata fra un'esecuzione e l'altra
+    """
+    def __init__(self, db_path: Optional[str] = None, memo_size: int = 8192):
+        self.memo: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.memo_size = memo_size
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS scores (key TEXT PRIMARY KEY, scores TEXT NOT NULL)")
+
+    def _remember(self, key: str, scores: Dict[str, Any]) -> None:
+        self.memo[key] = scores
+        if len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        scores = self.memo.get(key)
+        if scores is not None:
+            self.memo.move_to_end(key)
+            return scores
+        if self.db is not None:
+            row = self.db.execute("SELECT scores FROM scores WHERE key = ?", (key,)).fetchone()
+            if row:
+                scores = orjson.loads(row[0]) if orjson is not None else json.loads(row[0])
+                self._remember(key, scores)
+                return scores
+        return None
+
+    def put(self, key: str, scores: Dict[str, Any]) -> None:
+        self._remember(key, scores)
+        if self.db is not None:
+            self.db.execute("INSERT OR IGNORE INTO scores (key, scores) VALUES (?, ?)",
+                            (key, dump_scores(scores)))
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+# item per processo a ogni giro di map: abbastanza da ammortizzare il pickling,
+# senza tenere in coda l'intero dataset
+SCORE_CHUNK = 64
+
+def score_items(items: Iterable[Dict[str, Any]], section_boost: bool = True, workers: int = 1,
+                cache: Optional[ScoreCache] = None) -> Iterator[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    Restituisce (item, punteggi) nell'ordine di input.
+    I testi già visti (cache) non vengono ricalcolati; gli altri sono calcolati una volta
+    per blocco anche se ripetuti. Con workers > 1 il calcolo (CPU puro, indipendente per
+    item) è fatto da un pool di processi, a blocchi di workers * SCORE_CHUNK item; ai
+    processi vanno solo i testi mancanti.
+    """
+    cache = cache if cache is not None else ScoreCache()
+    score = partial(repetition_scores, section_boost=section_boost)
+    it = iter(items)
+    with (ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext()) as ex:
+        while True:
+            batch = list(islice(it, max(1, workers) * SCORE_CHUNK))
+            if not batch:
+                break
+            # punteggi del blocco per chiave: prima dalla cache, poi calcolati i mancanti
+            keys, found, missing = [], {}, {}
+            for item in batch:
+                text = item_lyrics(item)
+                key = score_key(text, section_boost)
+                keys.append(key)
+                if key in found or key in missing:
+                    continue
+                scores = cache.get(key)
+                if scores is None:
+                    missing[key] = text
+                else:
+                    found[key] = scores
+            if missing:
+                texts = list(missing.values())
+                computed = ex.map(score, texts, chunksize=SCORE_CHUNK) if ex is not None else map(score, texts)
+                for key, scores in zip(missing, computed):
+                    cache.put(key, scores)
+                    found[key] = scores
+            for item, key in zip(batch, keys):
+                yield item, found[key]
+
 # ----------------------------
 # Enrichment su JSON
 # ----------------------------
 
-def enrich(json_in: str, json_out: str = None, rep_tag_thr: float = 0.25, section_boost: bool = True) -> None:
+def iter_items(f) -> Iterator[Dict[str, Any]]:
+    """
+    Item del JSON di input (file aperto in binario).
+    Con ijson e un array al top-level: streaming, in memoria un item alla volta;
+    altrimenti json.load dell'intero file.
+    """
+    if ijson is not None:
+        head = f.read(4096).lstrip(b"\xef\xbb\xbf \t\r\n")[:1]
+        f.seek(0)
+        if head == b"[":
+            yield from ijson.items(f, "item", use_float=True)
+            return
+    yield from json.loads(f.read().decode("utf-8"))
+
+
+def dump_item(item: Dict[str, Any]) -> bytes:
+    """
+    Item in JSON indentato a 2 spazi, UTF-8 (non ASCII-escaped).
+    Con orjson è JSON equivalente a json.dumps(indent=2, ensure_ascii=False), non sempre
+    identico byte per byte: alcuni float hanno un'altra forma (es. 1.5e-7 invece di 1.5e-07).
+    """
+    if orjson is not None:
+        return orjson.dumps(item, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(item, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def enrich(json_in: str, json_out: str = None, rep_tag_thr: float = 0.25, section_boost: bool = True, workers: int = 1,
+           cache_db: Optional[str] = None) -> None:
     """
-    Carica il JSON, calcola i punteggi e:
+    Legge il JSON (in streaming se c'è ijson), calcola i punteggi e:
     - aggiorna item["repetition"]
     - arricchisce i tag:
         * catchy_chorus se has_chorus_like
         * hook_repetition se has_hook_like
         * high_repetition se rep_ratio >= rep_tag_thr
     Scrive su json_out (o sovrascrive json_in se json_out non fornito) con commit atomico.
+    workers > 1: punteggi calcolati in parallelo da più processi (stesso risultato).
+    cache_db: file SQLite con i punteggi già calcolati (riusati fra esecuzioni).
+    In-place, se nessun item cambia il file non viene riscritto.
     """
-    with open(json_in, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    out_path = json_out or json_in
+    tmp_path = out_path + ".tmp"
+    # In-place: finché gli item restano invariati (es. file già arricchito) non si scrive
+    # nulla; al primo item modificato si riparte dal file e si riscrive il prefisso.
+    in_place = os.path.abspath(out_path) == os.path.abspath(json_in)
 
+    # Lettura e scrittura in streaming: ogni item è arricchito e scritto subito.
+    # Stessa struttura di json.dump(data, indent=2, ensure_ascii=False) (JSON equivalente,
+    # vedi dump_item): ogni item indentato di un livello (nelle stringhe JSON i "\n"
+    # sono sempre escaped).
+    processed = 0
     changed = 0
-    for item in data:
-        # Lyrics: usa "lyrics", fallback a "text" se non presente
-        lyrics = item.get("lyrics") or item.get("text") or ""
-        scores = repetition_scores(lyrics, section_boost=section_boost)
-
-        # Sezione "repetition"
-        item["repetition"] = scores
-
-        # Tag arricchiti
-        tags = set(item.get("tags", []))
-        if scores["has_chorus_like"]:
-            tags.add("catchy_chorus")
-        if scores["has_hook_like"]:
-            tags.add("hook_repetition")
-        if scores["rep_ratio"] >= rep_tag_thr:
-            tags.add("high_repetition")
-        if tags:
-            item["tags"] = sorted(tags)
-
-        changed += 1
+    fout = None
+    cache = ScoreCache(cache_db)
+    try:
+        with open(json_in, "rb") as fin:
+            for item, scores in score_items(iter_items(fin), section_boost=section_boost, workers=workers, cache=cache):
+                # Tag arricchiti
+                tags = set(item.get("tags", []))
+                if scores["has_chorus_like"]:
+                    tags.add("catchy_chorus")
+                if scores["has_hook_like"]:
+                    tags.add("hook_repetition")
+                if scores["rep_ratio"] >= rep_tag_thr:
+                    tags.add("high_repetition")
+                tags = sorted(tags)
 
-    out_path = json_out or json_in
-    tmp_path = out_path + ".tmp"
+                # Item già aggiornato: sezione "repetition" e tag coincidono
+                if item.get("repetition") != scores or (tags and item.get("tags") != tags):
+                    changed += 1
+                    item["repetition"] = scores
+                    if tags:
+                        item["tags"] = tags
+
+                if fout is None:
+                    if in_place and not changed:
+                        processed += 1
+                        continue
+                    fout = open(tmp_path, "wb")
+                    if processed:
+                        # prefisso invariato: riletto dal file d'ingresso così com'è
+                        with open(json_in, "rb") as fprev:
+                            for n, prev in enumerate(islice(iter_items(fprev), processed)):
+                                fout.write(b",\n  " if n else b"[\n  ")
+                                fout.write(dump_item(prev).replace(b"\n", b"\n  "))
+
+                fout.write(b",\n  " if processed else b"[\n  ")
+                fout.write(dump_item(item).replace(b"\n", b"\n  "))
+                processed += 1
+    except BaseException:
+        if fout is not None:
+            fout.close()
+        raise
+    finally:
+        # anche in caso di errore: punteggi già calcolati confermati nella cache SQLite
+        cache.close()
 
-    # Scrittura pretty con indentazione; ensure_ascii=False per mantenere eventuali caratteri speciali
-    with open(tmp_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    if fout is None and in_place:
+        print(f"Nessun cambiamento: {json_in} - items processati: {processed}")
+        return
+    if fout is None:
+        fout = open(tmp_path, "wb")
+    with fout:
+        fout.write(b"\n]" if processed else b"[]")
 
     # Commit atomico cross-versione Windows/Python
     if os.path.exists(out_path):
@@ -184,7 +371,7 @@ def enrich(json_in: str, json_out: str = None, rep_tag_thr: float = 0.25, sectio
     else:
         os.rename(tmp_path, out_path)
 
-    print(f"Aggiornato: {out_path} - items processati: {changed}")
+    print(f"Aggiornato: {out_path} - items processati: {processed} (modificati: {changed})")
 
 # ----------------------------
 # CLI
@@ -197,13 +384,18 @@ def main():
     ap.add_argument("--rep-thr", type=float, default=0.25, help="Soglia per tag 'high_repetition' (default 0.25)")
     ap.add_argument("--no-section-boost", action="store_true",
                     help="Disabilita il boost dei flag se compaiono etichette [Chorus]/[Hook] nel testo")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Processi per il calcolo dei punteggi (default 1 = sequenziale)")
+    ap.add_argument("--cache-db", help="(Opzionale) File SQLite per riusare i punteggi fra esecuzioni (es. cache_scores.db)")
     args = ap.parse_args()
 
     enrich(
         json_in=args.json_in,
         json_out=args.json_out,
         rep_tag_thr=args.rep_thr,
-        section_boost=not args.no_section_boost
+        section_boost=not args.no_section_boost,
+        workers=args.workers,
+        cache_db=args.cache_db
     )
 
 if __name__ == "__main__":